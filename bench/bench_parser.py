@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Benchmark speed and accuracy of the P2000 message parser.
+
+Runs every line of a labelled FLEX ALN corpus through the parsing stages of
+p2000.py and reports lines per second and p50/p99 latency per stage, plus
+the accuracy of the extracted street, postal code, city and priority.
+With --compare the results are checked against the regex based parser in
+legacy_parser.py. Runs offline, no RTL-SDR, Home Assistant or OpenCage needed.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import legacy_parser  # noqa: E402
+import p2000  # noqa: E402
+
+CORPUS = "bench/corpus/p2000_aln_v2.tsv"
+CAPCODES = "bench/corpus/capcodes_v1.txt"
+FIELDS = ["street", "postalcode", "city", "priority"]
+COMPARE_FIELDS = ["message", "street", "postalcode", "city", "address", "priority"]
+
+
+class Context:
+    """Minimal stand-in for Main, needed by the p2000 load functions."""
+
+    def __init__(self):
+        self.logger = logging.getLogger("bench")
+
+
+def load_corpus(filename):
+    """Load corpus lines and labels."""
+    corpus = []
+    with open(filename, "r") as corpus_file:
+        for row in corpus_file:
+            if row.startswith("#") or not row.strip():
+                continue
+            # The message itself can have tabs, the labels are the last fields
+            line, street, postalcode, city, priority = row.rstrip("\n").rsplit("\t", 4)
+            corpus.append(
+                {
+                    "line": line,
+                    "street": street,
+                    "postalcode": postalcode,
+                    "city": city,
+                    "priority": int(priority),
+                }
+            )
+    return corpus
+
+
+def percentile(values, percent):
+    """Return percentile of sorted values."""
+    if not values:
+        return 0
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run_stage(name, func, inputs, repeat):
+    """Run func over all inputs repeat times, return timing statistics."""
+    timings = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            begin = time.perf_counter_ns()
+            func(item)
+            timings.append(time.perf_counter_ns() - begin)
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return {
+        "stage": name,
+        "lines": len(timings),
+        "lines_per_second": round(len(timings) / elapsed) if elapsed else 0,
+        "p50_us": round(percentile(timings, 50) / 1000, 1),
+        "p99_us": round(percentile(timings, 99) / 1000, 1),
+    }
+
+
+def load_messages(filename):
+    """Load messages from a file with multimon-ng output."""
+    messages = []
+    with open(filename, "r", errors="replace") as flex_file:
+        for line in flex_file:
+            fields = p2000.parse_flex_line(line.strip())
+            if fields:
+                messages.append(fields[3])
+    return messages
+
+
+def compare(addressparser, legacyparser, messages, verbose):
+    """Compare results of the parser with the regex based one, return statistics."""
+
+    def parse(message):
+        tokens = p2000.MessageTokens(message)
+        return (
+            *addressparser.parse(message, tokens),
+            p2000.p2000_get_prio(message, tokens),
+        )
+
+    def legacy_parse(message):
+        return (
+            *legacyparser.parse(message),
+            legacy_parser.legacy_get_prio(message),
+        )
+
+    different = dict.fromkeys(COMPARE_FIELDS, 0)
+    for message in messages:
+        found = dict(zip(COMPARE_FIELDS, parse(message)))
+        expected = dict(zip(COMPARE_FIELDS, legacy_parse(message)))
+        wrong = [field for field in COMPARE_FIELDS if found[field] != expected[field]]
+        for field in wrong:
+            different[field] += 1
+        if wrong and verbose:
+            print(f"{message}")
+            for field in wrong:
+                print(f"    {field}: regex '{expected[field]}', tokens '{found[field]}'")
+    return {
+        "messages": len(messages),
+        "different": different,
+        "regex": run_stage("regex", legacy_parse, messages, 1),
+        "tokens": run_stage("tokens", parse, messages, 1),
+    }
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS, help=f"corpus file (default {CORPUS})")
+    parser.add_argument(
+        "--capcodes", default=CAPCODES, help=f"capcodes file (default {CAPCODES})"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="runs over the corpus (default 20)"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show lines with wrong extractions"
+    )
+    parser.add_argument("--json", metavar="FILE", help="also write results to FILE")
+    parser.add_argument(
+        "--compare",
+        nargs="*",
+        metavar="FILE",
+        help="compare with the regex based parser on the corpus and FILEs with multimon-ng output",
+    )
+    args = parser.parse_args()
+
+    context = Context()
+    plaatsnamen = p2000.load_list(context, "db_plaatsnamen.txt")
+    pltsnmn = p2000.load_capcodes_dict(context, "db_pltsnmn.txt")
+    capcodes = p2000.load_capcodes_dict(context, args.capcodes)
+    addressparser = p2000.AddressParser(context.logger, plaatsnamen, pltsnmn)
+    corpus = load_corpus(os.path.join(p2000.datadir, args.corpus))
+
+    lines = [item["line"] for item in corpus]
+    flex = [p2000.parse_flex_line(line) for line in lines]
+    messages = [fields[3] for fields in flex]
+    capcode_lists = [fields[2].split(" ") for fields in flex]
+
+    def parse_all(line):
+        timestamp, groupid, capcodelist, message = p2000.parse_flex_line(line)
+        p2000.p2000_get_prio(message)
+        addressparser.parse(message)
+        p2000.p2000_get_capcode_info(capcodes, capcodelist.split(" "))
+
+    results = [
+        run_stage("split", p2000.parse_flex_line, lines, args.repeat),
+        run_stage("priority", p2000.p2000_get_prio, messages, args.repeat),
+        run_stage("address", addressparser.parse, messages, args.repeat),
+        run_stage(
+            "capcodes",
+            lambda capcodelist: p2000.p2000_get_capcode_info(capcodes, capcodelist),
+            capcode_lists,
+            args.repeat,
+        ),
+        run_stage("total", parse_all, lines, args.repeat),
+    ]
+
+    # Accuracy of the extracted fields
+    correct = dict.fromkeys(FIELDS, 0)
+    for item, message in zip(corpus, messages):
+        _, street, postalcode, city, _ = addressparser.parse(message)
+        found = {
+            "street": street,
+            "postalcode": postalcode,
+            "city": city,
+            "priority": p2000.p2000_get_prio(message),
+        }
+        wrong = [field for field in FIELDS if found[field] != item[field]]
+        for field in FIELDS:
+            if field not in wrong:
+                correct[field] += 1
+        if wrong and args.verbose:
+            print(f"{message}")
+            for field in wrong:
+                print(f"    {field}: expected '{item[field]}', found '{found[field]}'")
+    accuracy = {
+        field: round(100 * correct[field] / len(corpus), 1) for field in FIELDS
+    }
+
+    print(f"Corpus: {args.corpus}, {len(corpus)} lines, {args.repeat} runs")
+    print(f"{'stage':<10} {'lines/s':>10} {'p50 us':>10} {'p99 us':>10}")
+    for result in results:
+        print(
+            f"{result['stage']:<10} {result['lines_per_second']:>10} "
+            f"{result['p50_us']:>10} {result['p99_us']:>10}"
+        )
+    print("Accuracy: " + ", ".join(f"{field} {accuracy[field]}%" for field in FIELDS))
+
+    comparison = None
+    if args.compare is not None:
+        legacyparser = legacy_parser.LegacyAddressParser(
+            context.logger, plaatsnamen, pltsnmn
+        )
+        for filename in args.compare:
+            messages = messages + load_messages(filename)
+        comparison = compare(addressparser, legacyparser, messages, args.verbose)
+        print(f"Compared with regex parser: {comparison['messages']} messages")
+        print(
+            "Different: "
+            + ", ".join(f"{field} {count}" for field, count in comparison["different"].items())
+        )
+        for result in (comparison["regex"], comparison["tokens"]):
+            print(
+                f"{result['stage']:<10} {result['lines_per_second']:>10} "
+                f"{result['p50_us']:>10} {result['p99_us']:>10}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(
+                {
+                    "corpus": args.corpus,
+                    "lines": len(corpus),
+                    "stages": results,
+                    "accuracy": accuracy,
+                    "compare": comparison,
+                },
+                json_file,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Reference copy of the regex based message parser of p2000.py.
+
+p2000.py now extracts priority and address from the tokens of a message,
+bench_parser.py --compare checks it against this copy.
+"""
+import re
+
+
+class LegacyAddressParser:
+    """Address parser of p2000.py before the tokenizer, a chain of regexes."""
+
+    def __init__(self, logger, plaatsnamen, pltsnmn):
+        self.logger = logger
+        self.plaatsnamen = plaatsnamen
+        self.pltsnmn = pltsnmn
+
+    def parse(self, message):
+        """Return (message, street, postalcode, city, address).
+
+        Uppercase city abbreviations in the returned message are removed or
+        replaced by the city name.
+        """
+        postalcode = ""
+        city = ""
+        address = ""
+        street = ""
+
+        # Get address info if any, look for valid postalcode and get the two words around them
+        # A2 (DIA: ja) AMBU 17106 Schiedamseweg 3134BA Vlaardingen VLAARD bon 8576
+        regex_address = r"(\w*.) ([1-9][0-9]{3}[a-zA-Z]{2}) (.\w*)"
+        addr = re.search(regex_address, message)
+        if addr:
+            street = addr.group(1)
+            postalcode = addr.group(2)
+            city = addr.group(3)
+            address = f"{street} {postalcode} {city}"
+
+            # Remove Capitalized city name from message (when postalcode is found)
+            regex_afkortingen = "[A-Z]{2,}"
+            afkortingen = re.findall(regex_afkortingen, message)
+            for afkorting in afkortingen:
+                if afkorting in self.pltsnmn:
+                    message = re.sub(afkorting, "", message)
+
+        # Get address in info if any, look for valid postalcode without letters and get the two words around them
+        # A1 13108 Surinameplein 1058 Amsterdam 12006
+        regex_address2 = r"(\w*.) ([1-9][0-9]{3}) (.\w*)"
+        addr2 = re.search(regex_address2, message)
+        if addr2:
+            # print("Regex Amsterdam")
+            street = addr2.group(1)
+            postalcode = addr2.group(2)
+            city = addr2.group(3)
+            address = f"{street} {city}"
+
+            # Remove Capitalized city name from message (when postalcode is found)
+            regex_afkortingen = "[A-Z]{2,}"
+            afkortingen = re.findall(regex_afkortingen, message)
+            for afkorting in afkortingen:
+                if afkorting in self.pltsnmn:
+                    message = re.sub(afkorting, "", message)
+
+        # Try to get city only when there is one after a prio
+        # A1 Breda
+        else:
+            regex_prio_loc = r"(^A\s?1|\s?A\s?2|B\s?1|^B\s?2|^B\s?3|PRIO\s?1|^P\s?1|PRIO\s?2|^P\s?2) (.\w*)"
+            loc = re.search(regex_prio_loc, message)
+            if loc and loc.group(2) in self.plaatsnamen:
+                city = loc.group(2)
+            else:
+                # Find all uppercase words and check if there is a valid city name amoung them
+                # A2 Ambulancepost Moordrecht Middelweg MOORDR V
+                regex_afkortingen = "[A-Z]{2,}"
+                afkortingen = re.findall(regex_afkortingen, message)
+                for afkorting in afkortingen:
+                    if afkorting in self.pltsnmn:
+                        city = self.pltsnmn[afkorting]["plaatsnaam"]
+                        # If uppercase city is found, grab first word before that city name, since it's likely to be the streetname
+                        regex_address = rf"(\w*.) ({afkorting})"
+                        addr = re.search(regex_address, message)
+                        if addr:
+                            street = addr.group(1)
+                        address = f"{street} {city}"
+                        # Change uppercase city to normal city in message
+                        message = re.sub(afkorting, city, message)
+
+            # If no address is found, do a wild guess
+            if not address:
+                # Strip all status info from messag
+                regex_messagestrip = r"(^A\s?1|\s?A\s?2|B\s?1|^B\s?2|^B\s?3|PRIO\s?1|^P\s?1|PRIO\s?2|^P\s?2|^PRIO\s?3|^P\s?3|^PRIO\s?4|^P\s?4)(\W\d{2,}|.*(BR)\b|)|(rit:|rit|bon|bon:|ambu|dia|DIA)\W\d{5,8}|\b\d{5,}$|( : )|\(([^\)]+)\)( \b\d{5,}|)|directe (\w*)|(-)+/gi"
+                strip = re.sub(regex_messagestrip, "", message, flags=re.I)
+                # Strip any double spaces from message
+                regex_doublespaces = r"(^[ \t]+|[ \t]+$)"
+                strip = re.sub(regex_doublespaces, "", strip)
+                # Strip all double words from message
+                regex_doublewords = r"(\b\S+\b)(?=.*\1)"
+                strip = re.sub(regex_doublewords, "", strip)
+                # print("Strip: " + strip)
+                # Search in leftover message for a city corresponding to City list
+                for plaatsnaam in self.plaatsnamen:
+                    if plaatsnaam in strip:
+                        self.logger.debug("City found: " + plaatsnaam)
+                        # Find first word left from city
+                        regex_plaatsnamen_strip = rf"\w*.[a-z|A-Z] \b{plaatsnaam}\b"
+                        plaatsnamen_strip = re.search(regex_plaatsnamen_strip, strip)
+                        if plaatsnamen_strip:
+                            addr = plaatsnamen_strip.group(0)
+                            # Final non address symbols strip
+                            regex_plaatsnamen_strip_strip = r"(- )|(\w[0-9] )"
+                            addr = re.sub(regex_plaatsnamen_strip_strip, "", addr)
+                            address = addr
+                            city = plaatsnaam
+                            self.logger.debug("Adress found: " + plaatsnamen_strip.group(0))
+
+        return message, street, postalcode, city, address
+
+
+def legacy_get_prio(message):
+    """Look for priority strings and return level."""
+    priority = 0
+
+    regex_prio1 = r"^A\s?1|\s?A\s?1|PRIO\s?1|^P\s?1"
+    regex_prio2 = r"^A\s?2|\s?A\s?2|PRIO\s?2|^P\s?2"
+    regex_prio3 = r"^B\s?1|^B\s?2|^B\s?3|PRIO\s?3|^P\s?3"
+    regex_prio4 = r"^PRIO\s?4|^P\s?4"
+
+    if re.search(regex_prio1, message, re.IGNORECASE):
+        priority = 1
+    elif re.search(regex_prio2, message, re.IGNORECASE):
+        priority = 2
+    elif re.search(regex_prio3, message, re.IGNORECASE):
+        priority = 3
+    elif re.search(regex_prio4, message, re.IGNORECASE):
+        priority = 4
+
+    return priority
+
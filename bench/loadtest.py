@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""Load test the P2000 receiver end-to-end with synthetic FLEX traffic.
+
+Starts a stub Home Assistant REST API and a minimal MQTT broker on localhost,
+runs a copy of p2000.py in replay mode reading from a pipe, and writes
+synthetic FLEX ALN lines to it at each requested rate. Every post that arrives
+at the stubs is matched to the line it came from, so the report shows
+end-to-end latency from line written to sink receipt, sustained throughput and
+the rate at which posts start to get lost.
+"""
+import argparse
+import configparser
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHDIR = os.path.dirname(os.path.realpath(__file__))
+REPODIR = os.path.dirname(BENCHDIR)
+
+# Files copied next to the receiver, it keeps its cache and logs there too
+RECEIVER_FILES = ["p2000.py", "db_capcodes.txt", "db_plaatsnamen.txt", "db_pltsnmn.txt"]
+
+# Synthetic message bodies carry run and sequence number, e.g. LT2-000042
+MESSAGE_ID = re.compile(r"LT(\d+)-(\d+)")
+
+# Latency growth between first and last quarter of a run that counts as backlog
+BACKLOG_GROWTH = 0.5
+
+
+class Receipts:
+    """Thread-safe list of (time, sink, run, seq, target) of received posts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = []
+
+    def add(self, sink, target, text):
+        received = time.monotonic()
+        found = MESSAGE_ID.search(text)
+        if not found:
+            return
+        with self.lock:
+            self.items.append(
+                (received, sink, int(found.group(1)), int(found.group(2)), target)
+            )
+
+    def for_run(self, run):
+        with self.lock:
+            return [item for item in self.items if item[2] == run]
+
+
+class HassHandler(BaseHTTPRequestHandler):
+    """Stub of the Home Assistant /api/states/sensor.* endpoint."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.path.startswith("/api/states/sensor."):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            state = json.loads(body)["state"]
+        except (ValueError, KeyError):
+            state = ""
+        self.server.receipts.add("home-assistant", self.path, state)
+        response = json.dumps({"entity_id": self.path.rsplit("/", 1)[1]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MqttHandler(socketserver.BaseRequestHandler):
+    """Minimal MQTT 3.1.1 broker, accepts CONNECT and PUBLISH, answers PINGREQ."""
+
+    def read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def handle(self):
+        try:
+            while True:
+                header = self.read(1)[0]
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = self.read(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                packet = self.read(length)
+                kind = header >> 4
+                if kind == 1:
+                    # CONNECT, accept
+                    self.request.sendall(b"\x20\x02\x00\x00")
+                elif kind == 3:
+                    # PUBLISH, acknowledge QoS 1 and 2
+                    qos = (header >> 1) & 0x03
+                    topic_length = int.from_bytes(packet[:2], "big")
+                    topic = packet[2 : 2 + topic_length].decode()
+                    offset = 2 + topic_length
+                    if qos:
+                        packet_id = packet[offset : offset + 2]
+                        offset += 2
+                        self.request.sendall((b"\x40\x02" if qos == 1 else b"\x50\x02") + packet_id)
+                    self.server.receipts.add(
+                        "mqtt", topic, packet[offset:].decode("utf8", "replace")
+                    )
+                elif kind == 6:
+                    # PUBREL, complete QoS 2
+                    self.request.sendall(b"\x70\x02" + packet[:2])
+                elif kind == 12:
+                    # PINGREQ
+                    self.request.sendall(b"\xd0\x00")
+                elif kind == 14:
+                    # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            return
+
+
+class MqttServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def free_port():
+    """Return a free TCP port on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_sensors(count):
+    """Return {name: capcode} of synthetic sensors, one capcode each."""
+    return {f"loadtest{n:03d}": f"{1500000 + n * 7:09d}" for n in range(count)}
+
+
+def setup_receiver(workdir):
+    """Copy the receiver and its databases to workdir."""
+    for filename in RECEIVER_FILES:
+        if os.path.exists(os.path.join(REPODIR, filename)):
+            shutil.copy(os.path.join(REPODIR, filename), workdir)
+    # An empty ignore list ignores nothing, a typical entry makes the filter do its usual work
+    with open(os.path.join(workdir, "ignore_text.txt"), "w") as text_file:
+        text_file.write("*Test maandelijks*\n")
+    return os.path.join(workdir, "p2000.py")
+
+
+def write_config(filename, hass_port, mqtt_port, sensors, post_delay, workers):
+    """Write a receiver config that posts to the stubs."""
+    config = configparser.ConfigParser()
+    config["main"] = {"debug": False, "logtofile": False, "post_delay": post_delay}
+    config["rtl-sdr"] = {"cmd": "true"}
+    config["home-assistant"] = {
+        "enabled": True,
+        "baseurl": f"http://127.0.0.1:{hass_port}",
+        "token": "loadtest",
+        "workers": workers,
+        "timeout": 10,
+    }
+    config["mqtt"] = {
+        "enabled": True,
+        "mqtt_server": "127.0.0.1",
+        "mqtt_port": mqtt_port,
+        "mqtt_user": "loadtest",
+        "mqtt_password": "loadtest",
+        "mqtt_topic": "p2000",
+        "mqtt_qos": 0,
+        "mqtt_queue_size": 1000,
+    }
+    config["opencage"] = {"enabled": False, "token": ""}
+    for name, capcode in sensors.items():
+        config[f"sensor_{name}"] = {"searchcapcode": capcode}
+    with open(filename, "w") as configfile:
+        config.write(configfile)
+
+
+def make_messages(run, count, sensors, fanout, rand):
+    """Return list of (line, expected posts per sink) of synthetic FLEX lines.
+
+    Each message has 1 to fanout capcodes, the first one always belongs to a
+    sensor, the others are drawn from sensor and unknown capcodes alike.
+    """
+    sensor_capcodes = list(sensors.values())
+    pool = sensor_capcodes + [f"{2900000 + n:09d}" for n in range(len(sensor_capcodes))]
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    messages = []
+    for seq in range(count):
+        capcodes = [rand.choice(sensor_capcodes)]
+        for _ in range(rand.randint(1, fanout) - 1):
+            capcode = rand.choice(pool)
+            if capcode not in capcodes:
+                capcodes.append(capcode)
+        expected = sum(1 for capcode in capcodes if capcode in sensor_capcodes)
+        line = (
+            f"FLEX|{timestamp}|1600/2/K/A|10.120|{' '.join(capcodes)}|ALN|"
+            f"A1 Rit LT{run}-{seq:06d} Teststraat {seq % 200 + 1} 1011AB Amsterdam\n"
+        )
+        messages.append((line, expected))
+    return messages
+
+
+def percentile(values, percent):
+    """Return percentile of sorted values."""
+    if not values:
+        return 0
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run_rate(args, run, rate, receipts, receiver_file, config_file, logdir, rand):
+    """Feed the receiver at rate messages/s, return statistics of the run."""
+    count = max(1, int(rate * args.duration))
+    messages = make_messages(run, count, make_sensors(args.sensors), args.fanout, rand)
+    expected = sum(posts for line, posts in messages)
+
+    logfile = open(os.path.join(logdir, f"receiver-{rate:g}.log"), "w")
+    receiver = subprocess.Popen(
+        [sys.executable, receiver_file, "--config", config_file, "--replay", "-", "--speed", "0"],
+        stdin=subprocess.PIPE,
+        stdout=logfile,
+        stderr=subprocess.STDOUT,
+    )
+    # Give the receiver time to load its databases and connect to MQTT
+    time.sleep(args.startup)
+
+    sent = {}
+    started = time.monotonic()
+    try:
+        for seq, (line, posts) in enumerate(messages):
+            delay = started + seq / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            sent[seq] = time.monotonic()
+            receiver.stdin.write(line.encode())
+            receiver.stdin.flush()
+        receiver.stdin.close()
+    except BrokenPipeError:
+        pass
+    finished = time.monotonic()
+
+    # Receiver stops by itself once all messages are posted
+    try:
+        receiver.wait(timeout=args.drain)
+    except subprocess.TimeoutExpired:
+        receiver.send_signal(signal.SIGINT)
+        try:
+            receiver.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            receiver.kill()
+            receiver.wait()
+    logfile.close()
+
+    # First receipt of every post per sink, later ones are updates
+    first = {}
+    for received, sink, _, seq, target in receipts.for_run(run):
+        key = (sink, seq, target)
+        if key not in first or received < first[key]:
+            first[key] = received
+    latencies = sorted(received - sent[seq] for (sink, seq, target), received in first.items() if seq in sent)
+    by_seq = {}
+    for (sink, seq, target), received in first.items():
+        if seq in sent:
+            by_seq[seq] = max(by_seq.get(seq, 0), received - sent[seq])
+
+    # Backlog shows as latency growing over the run
+    quarter = max(1, len(sent) // 4)
+    head = sorted(by_seq[seq] for seq in range(quarter) if seq in by_seq)
+    tail = sorted(by_seq[seq] for seq in range(len(sent) - quarter, len(sent)) if seq in by_seq)
+    growth = percentile(tail, 50) - percentile(head, 50)
+
+    delivered = len(latencies)
+    last = max(first.values(), default=finished)
+    sinks = 2
+    return {
+        "rate": rate,
+        "messages": len(sent),
+        "send_rate": round(len(sent) / (finished - started), 1) if finished > started else 0,
+        "expected_posts": expected * sinks,
+        "delivered_posts": delivered,
+        "dropped_posts": expected * sinks - delivered,
+        "throughput": round(delivered / sinks / (last - started), 1) if last > started else 0,
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(latencies[-1], 3) if latencies else 0,
+        "latency_growth": round(growth, 3),
+        "backlog": growth > BACKLOG_GROWTH,
+        "exit_code": receiver.returncode,
+    }
+
+
+def main():
+    """Run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rates", default="1,10,100", help="messages/s to test, comma separated (default 1,10,100)"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds of traffic per rate (default 30)"
+    )
+    parser.add_argument(
+        "--sensors", type=int, default=20, help="number of sensors in the config (default 20)"
+    )
+    parser.add_argument(
+        "--fanout", type=int, default=4, help="maximum capcodes per message (default 4)"
+    )
+    parser.add_argument(
+        "--post-delay", type=float, default=1.0, help="receiver post_delay in seconds (default 1.0)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="receiver Home Assistant workers (default 4)"
+    )
+    parser.add_argument(
+        "--hass-latency", type=float, default=0, help="seconds the Home Assistant stub takes per post (default 0)"
+    )
+    parser.add_argument(
+        "--startup", type=float, default=5, help="seconds to wait for the receiver to start (default 5)"
+    )
+    parser.add_argument(
+        "--drain", type=float, default=30, help="seconds after the last line before posts count as dropped (default 30)"
+    )
+    parser.add_argument("--seed", type=int, default=2000, help="random seed (default 2000)")
+    parser.add_argument("--keep", action="store_true", help="keep config and receiver logs")
+    parser.add_argument("--json", metavar="FILE", help="also write results to FILE")
+    args = parser.parse_args()
+
+    rates = [float(rate) for rate in args.rates.split(",")]
+    rand = random.Random(args.seed)
+    receipts = Receipts()
+
+    hass = ThreadingHTTPServer(("127.0.0.1", free_port()), HassHandler)
+    hass.daemon_threads = True
+    hass.receipts = receipts
+    hass.latency = args.hass_latency
+    broker = MqttServer(("127.0.0.1", free_port()), MqttHandler)
+    broker.receipts = receipts
+    for server in (hass, broker):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix="p2000-loadtest-")
+    receiver_file = setup_receiver(workdir)
+    config_file = os.path.join(workdir, "loadtest.ini")
+    write_config(
+        config_file,
+        hass.server_address[1],
+        broker.server_address[1],
+        make_sensors(args.sensors),
+        args.post_delay,
+        args.workers,
+    )
+    print(
+        f"{args.sensors} sensors, up to {args.fanout} capcodes per message, "
+        f"post_delay {args.post_delay}s, {args.duration:g}s per rate"
+    )
+    print(
+        f"{'rate':>8} {'sent/s':>8} {'posts':>8} {'dropped':>8} {'p50 s':>8} "
+        f"{'p95 s':>8} {'p99 s':>8} {'max s':>8} {'msg/s':>8}  backlog"
+    )
+
+    results = []
+    try:
+        for run, rate in enumerate(rates, start=1):
+            result = run_rate(
+                args, run, rate, receipts, receiver_file, config_file, workdir, rand
+            )
+            results.append(result)
+            print(
+                f"{result['rate']:>8g} {result['send_rate']:>8} {result['delivered_posts']:>8} "
+                f"{result['dropped_posts']:>8} {result['p50']:>8} {result['p95']:>8} "
+                f"{result['p99']:>8} {result['max']:>8} {result['throughput']:>8}  "
+                f"{'yes' if result['backlog'] else 'no'} (+{result['latency_growth']}s)"
+            )
+            if result["exit_code"] not in (0, None) and not result["delivered_posts"]:
+                print(f"Receiver failed, see log in {workdir}")
+                args.keep = True
+                break
+    finally:
+        hass.shutdown()
+        broker.shutdown()
+
+    sustained = [r["rate"] for r in results if not r["backlog"] and not r["dropped_posts"]]
+    dropping = [r["rate"] for r in results if r["dropped_posts"]]
+    print(f"Sustained without backlog or drops: {max(sustained):g} msg/s" if sustained else "No rate sustained without backlog or drops")
+    print(f"Posts dropped from: {min(dropping):g} msg/s" if dropping else "No posts dropped")
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"options": vars(args), "results": results}, json_file, indent=4)
+    if args.keep:
+        print(f"Config and receiver logs kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Compile db_capcodes.txt to db_capcodes.bin, which p2000.py memory-maps.
+
+Usage: gen_db_capcodes_bin.py [textfile] [binfile]
+"""
+import os
+import sys
+import time
+
+# Change dir to working directory
+dir_path = os.path.dirname(os.path.realpath(__file__))
+os.chdir(dir_path)
+os.chdir('../..')
+sys.path.insert(0, os.getcwd())
+
+import p2000  # noqa: E402
+
+textfile = sys.argv[1] if len(sys.argv) > 1 else 'db_capcodes.txt'
+binfile = sys.argv[2] if len(sys.argv) > 2 else 'db_capcodes.bin'
+
+if not os.path.exists(textfile):
+    print(f'Cannot find {textfile}, run gen_db_capcodes.py first')
+    sys.exit(1)
+
+started = time.perf_counter()
+with open(textfile, 'r') as csv_file:
+    rows = [[value.strip() for value in line.split(',')] for line in csv_file]
+
+# Same layout as read by load_capcodes_dict, first column is the capcode
+(_, *fields), *data = rows
+records = {}
+skipped = 0
+for capcode, *values in data:
+    if len(capcode) != 9 or not capcode.isdigit():
+        skipped += 1
+        continue
+    records[capcode] = values
+
+count = p2000.write_capcodes_db(binfile, fields, records)
+print(f'Wrote {count} capcodes to {binfile} in {time.perf_counter() - started:.2f}s, skipped {skipped} invalid lines')
@@ -1,13 +1,30 @@
 #!/usr/bin/env python3
 """RTL-SDR P2000 Receiver for Home Assistant."""
+import argparse
+import bisect
 import calendar
+import collections
+import concurrent.futures
 import configparser
 import csv
+import ctypes
+import ctypes.util
 import fnmatch
+import functools
+import heapq
+import http.server
+import itertools
 import json
 import logging
+import mmap
 import os
+import queue
 import re
+import select
+import signal
+import sqlite3
+import string
+import struct
 import subprocess
 import sys
 import threading
@@ -16,6 +33,7 @@ from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler as _TimedRotatingFileHandler
 
 import geopy.distance
+import numpy
 import paho.mqtt.client as mqtt
 import requests
 from opencage.geocoder import InvalidInputError, OpenCageGeocode, RateLimitExceededError
@@ -23,6 +41,14 @@ from opencage.geocoder import InvalidInputError, OpenCageGeocode, RateLimitExcee
 VERSION = "0.1.1"
 CFGFILE = "config.ini"
 
+# Compiled capcode database: header (magic, capcodes, fields, offset of the
+# string table), field name ids, sorted capcodes, field value ids per capcode
+# and the string table with every distinct string once (uint16 length, utf8)
+CAPCODE_DB_MAGIC = b"P2KCAPS1"
+CAPCODE_DB_HEADER = struct.Struct("<8sIII")
+UINT16 = struct.Struct("<H")
+UINT32 = struct.Struct("<I")
+
 
 class TimedRotatingFileHandler(_TimedRotatingFileHandler):
     """Override original code to fix bug with not deleting old logfiles."""
@@ -148,9 +174,247 @@ class Logger:
         self.log(message, "debug")
 
 
+class Metrics:
+    """Pipeline counters, gauges and latency histograms.
+
+    Gauges can be functions, they are called when the metrics are collected.
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    HELP = {
+        "p2000_lines_total": ("counter", "Lines read from multimon-ng by type."),
+        "p2000_messages_total": ("counter", "FLEX messages by outcome."),
+        "p2000_filtered_total": ("counter", "Messages ignored per filter rule."),
+        "p2000_stage_seconds": ("histogram", "Processing time per pipeline stage."),
+        "p2000_geocode_cache_total": ("counter", "Geocode cache lookups by result."),
+        "p2000_geocode_requests_total": ("counter", "OpenCage lookups by result."),
+        "p2000_geocode_seconds": ("histogram", "Duration of OpenCage lookups."),
+        "p2000_geocode_dropped_total": ("counter", "Lookups skipped because the queue was full."),
+        "p2000_geocode_queue_depth": ("gauge", "Addresses waiting for an OpenCage lookup."),
+        "p2000_geocode_ratelimited": ("gauge", "1 while OpenCage lookups are disabled by the rate limit."),
+        "p2000_posts_total": ("counter", "Posts per sink by result."),
+        "p2000_post_seconds": ("histogram", "Duration of posts per sink."),
+        "p2000_message_latency_seconds": ("histogram", "Time from line read to first post of a message."),
+        "p2000_pending_messages": ("gauge", "Messages waiting to be posted."),
+        "p2000_mqtt_queue_depth": ("gauge", "MQTT messages queued while disconnected."),
+        "p2000_mqtt_connected": ("gauge", "1 while connected to the MQTT broker."),
+        "p2000_ingest_lines_total": ("counter", "Lines read per ingest pipeline."),
+        "p2000_ingest_duplicates_total": ("counter", "FLEX frames dropped because another pipeline received them first."),
+        "p2000_ingest_restarts_total": ("counter", "Restarts of ingest pipelines after they stopped or stalled."),
+        "p2000_ingest_downtime_seconds_total": ("counter", "Time ingest pipelines waited to be restarted."),
+        "p2000_ingest_up": ("gauge", "1 while the process of an ingest pipeline is running."),
+        "p2000_reloads_total": ("counter", "Reloads of changed files by result."),
+        "p2000_reload_seconds": ("histogram", "Duration of reloads of changed files."),
+        "p2000_reload_records": ("gauge", "Records loaded by the last reload of a file."),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.functions = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Increase counter."""
+        key = self.key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set gauge value."""
+        with self.lock:
+            self.values[self.key(name, labels)] = value
+
+    def set_function(self, name, function, **labels):
+        """Set function that returns the value when collected."""
+        with self.lock:
+            self.functions[self.key(name, labels)] = function
+
+    def observe(self, name, value, **labels):
+        """Add value (seconds) to histogram."""
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Count per bucket, +Inf bucket, sum
+                histogram = self.histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            histogram[bisect.bisect_left(self.BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def collect(self):
+        """Return copies of all values and histograms."""
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception as err:
+                logging.getLogger().debug(f"Collecting metric {key[0]} failed: {err}")
+        return values, histograms
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def render(self):
+        """Return all metrics in Prometheus text format."""
+        values, histograms = self.collect()
+        names = sorted({name for name, _ in values} | {name for name, _ in histograms})
+        lines = []
+        for name in names:
+            kind, text = self.HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                count = 0
+                for bound, bucket in zip(self.BUCKETS + ("+Inf",), histogram):
+                    count += bucket
+                    bucket_labels = self.format_labels(labels + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{bucket_labels} {count}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Return flat dict of all values, histograms as count and average in ms."""
+        values, histograms = self.collect()
+        summary = {}
+        for (name, labels), value in sorted(values.items()):
+            key = "_".join([name.replace("p2000_", "", 1)] + [str(v) for _, v in labels])
+            summary[key] = value
+        for (name, labels), histogram in sorted(histograms.items()):
+            key = "_".join([name.replace("p2000_", "", 1)] + [str(v) for _, v in labels])
+            count = sum(histogram[:-1])
+            summary[key + "_count"] = count
+            summary[key + "_avg_ms"] = round(1000 * histogram[-1] / count, 1) if count else 0
+        return summary
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve /metrics in Prometheus text format."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """HTTP server for the metrics endpoint, runs in a background thread."""
+
+    def __init__(self, logger, metrics, host, port):
+        self.logger = logger
+        self.address = f"http://{host}:{port}/metrics"
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = metrics
+        self.thread = threading.Thread(
+            name="MetricsThread", target=self.server.serve_forever, daemon=True
+        )
+
+    def start(self):
+        """Start serving."""
+        self.logger.info(f"Serving metrics on {self.address}")
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def message_fingerprint(body):
+    """Return key for copies of the same message, ignores case and whitespace."""
+    return " ".join(body.split()).casefold()
+
+
+def join_unique(text, value):
+    """Add value to comma separated text if it is not in there yet."""
+    if not value or value in text.split(", "):
+        return text
+    if not text:
+        return value
+    return text + ", " + value
+
+
+def sensor_payload(head, distance, friendly_name):
+    """Complete payload head of a message with the attributes of one sensor."""
+    return b"".join(
+        (
+            head,
+            b',"distance":',
+            json.dumps(distance).encode(),
+            b',"friendly_name":',
+            json.dumps(friendly_name).encode(),
+            b"}}",
+        )
+    )
+
+
 class MessageItem:
     """Contains all the Message data."""
 
+    __slots__ = (
+        "timestamp",
+        "message_raw",
+        "timereceived",
+        "groupid",
+        "receivers",
+        "capcodes",
+        "body",
+        "location",
+        "postalcode",
+        "city",
+        "address",
+        "street",
+        "region",
+        "priority",
+        "disciplines",
+        "remarks",
+        "longitude",
+        "latitude",
+        "opencage",
+        "gps_checked",
+        "mapurl",
+        "is_posted",
+        "posted_sensors",
+        "new_sensors_only",
+        "release_deadline",
+        "post_sequence",
+        "geocode_pending",
+        "geocode_deadline",
+        "geocoded",
+        "routes",
+        "sources",
+    )
+
     def __init__(self):
         self.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.message_raw = ""
@@ -172,15 +436,963 @@ class MessageItem:
         self.longitude = ""
         self.latitude = ""
         self.opencage = ""
+        self.gps_checked = False
         self.mapurl = ""
-        self.distance = ""
-        self.friendly_name = ""
+        self.is_posted = False
+        self.posted_sensors = set()
+        self.new_sensors_only = False
+        self.release_deadline = 0
+        self.post_sequence = 0
+        self.geocode_pending = False
+        self.geocode_deadline = 0
+        self.geocoded = None
+        self.routes = None
+        self.sources = []
+
+    def payload_head(self):
+        """Return message as compact JSON without the sensor attributes.
+
+        The payload of a sensor is completed with sensor_payload.
+        """
+        data = {
+            "state": self.body,
+            "attributes": {
+                "time received": self.timestamp,
+                "group id": self.groupid,
+                "receivers": self.receivers,
+                "capcodes": self.capcodes,
+                "priority": self.priority,
+                "disciplines": self.disciplines,
+                "raw message": self.message_raw,
+                "region": self.region,
+                "location": self.location,
+                "postal code": self.postalcode,
+                "city": self.city,
+                "address": self.address,
+                "street": self.street,
+                "remarks": self.remarks,
+                "longitude": self.longitude,
+                "latitude": self.latitude,
+                "opencage": self.opencage,
+                "mapurl": self.mapurl,
+                "sources": self.sources,
+            },
+        }
+        # Strip the closing braces of attributes and data
+        return json.dumps(data, separators=(",", ":")).encode()[:-2]
+
+    def merge(self, receiver, discipline, remark, region, capcodes):
+        """Add info of another copy of this message, return True if anything was new."""
+        before = (self.receivers, self.disciplines, self.remarks, len(self.capcodes))
+        self.receivers = join_unique(self.receivers, receiver)
+        self.disciplines = join_unique(self.disciplines, discipline)
+        self.remarks = join_unique(self.remarks, remark)
+        if self.region == "":
+            self.region = region
+        for capcode in capcodes:
+            if capcode not in self.capcodes:
+                self.capcodes.append(capcode)
+        return before != (
+            self.receivers,
+            self.disciplines,
+            self.remarks,
+            len(self.capcodes),
+        )
+
+
+class MqttPublisher:
+    """Long-lived MQTT connection with automatic reconnect and outbound queue."""
+
+    def __init__(
+        self, logger, server, port, username, password, qos=0, queue_size=1000, metrics=None
+    ):
+        self.logger = logger
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.server = server
+        self.port = port
+        self.qos = qos
+        self.connected = False
+        self.queue = collections.deque(maxlen=queue_size)
+        self.lock = threading.Lock()
+
+        self.client = mqtt.Client()
+        self.client.username_pw_set(username, password)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=120)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+
+    def start(self):
+        """Connect in the background and start the network loop."""
+        self.logger.info(f"Connecting to MQTT broker {self.server}:{self.port}")
+        self.client.connect_async(self.server, self.port, 60)
+        self.client.loop_start()
+
+    def stop(self):
+        """Disconnect and stop the network loop."""
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        """Flush queued messages when the connection is established."""
+        if rc != 0:
+            self.logger.error(f"MQTT connection refused: {mqtt.connack_string(rc)}")
+            return
+        self.logger.info(f"Connected to MQTT broker {self.server}:{self.port}")
+        with self.lock:
+            self.connected = True
+            while self.queue:
+                topic, payload = self.queue.popleft()
+                self.client.publish(topic, payload, qos=self.qos)
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        """Mark connection as lost, paho reconnects with backoff."""
+        with self.lock:
+            self.connected = False
+        if rc != 0:
+            self.logger.warning("MQTT connection lost, reconnecting")
+
+    def publish(self, topic, payload):
+        """Publish payload or queue it until the broker is connected."""
+        started = time.perf_counter()
+        with self.lock:
+            if self.connected:
+                result = self.client.publish(topic, payload, qos=self.qos)
+                if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self.metrics.observe(
+                        "p2000_post_seconds", time.perf_counter() - started, sink="mqtt"
+                    )
+                    self.metrics.inc("p2000_posts_total", sink="mqtt", result="ok")
+                    return
+            if len(self.queue) == self.queue.maxlen:
+                self.logger.warning("MQTT queue full, dropping oldest message")
+                self.metrics.inc("p2000_posts_total", sink="mqtt", result="dropped")
+            else:
+                self.metrics.inc("p2000_posts_total", sink="mqtt", result="queued")
+            self.queue.append((topic, payload))
+
+
+class HassPoster:
+    """Post sensor states to the Home Assistant REST API over pooled connections."""
+
+    def __init__(self, logger, token, workers=4, timeout=10, metrics=None):
+        self.logger = logger
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.timeout = timeout
+
+        # Keep-alive connections shared by all sensors
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "Authorization": "Bearer " + token,
+                "content-type": "application/json",
+            }
+        )
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="HassThread"
+        )
+
+    def stop(self):
+        """Wait for running posts and close all connections."""
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def post_state(self, sensor, payload):
+        """Post state and attributes (JSON bytes) of one sensor."""
+        started = time.perf_counter()
+        try:
+            self.logger.debug(f"Posting to Home Assistant - {sensor.name}")
+            response = self.session.post(
+                sensor.entity_url,
+                data=payload,
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            self.logger.debug(f"POST data: {payload}")
+            self.logger.debug(f"POST status: {response.status_code} {response.reason}")
+            self.logger.debug(f"POST text: {response.text}")
+            self.metrics.observe(
+                "p2000_post_seconds", time.perf_counter() - started, sink="home-assistant"
+            )
+            self.metrics.inc("p2000_posts_total", sink="home-assistant", result="ok")
+            return True
+        except requests.HTTPError as err:
+            self.logger.error(
+                f"HTTP Error while trying to post data, check baseurl and token in config.ini: {err.response.status_code} {err.response.reason}"
+            )
+        except requests.exceptions.SSLError as err:
+            self.logger.error(
+                f"SSL Error occurred while trying to post data, check baseurl in config.ini:\n{err}"
+            )
+        except requests.exceptions.Timeout as err:
+            self.logger.error(
+                f"Timeout occurred while trying to post data to sensor.{sensor.name}:\n{err}"
+            )
+        except requests.exceptions.ConnectionError as err:
+            self.logger.error(
+                f"Connection Error occurred while trying to post data, check baseurl in config.ini:\n{err}"
+            )
+        self.metrics.observe(
+            "p2000_post_seconds", time.perf_counter() - started, sink="home-assistant"
+        )
+        self.metrics.inc("p2000_posts_total", sink="home-assistant", result="error")
+        return False
+
+    def post_states(self, posts):
+        """Post a list of (sensor, payload) concurrently and wait until all are done."""
+        futures = [
+            self.executor.submit(self.post_state, sensor, payload)
+            for sensor, payload in posts
+        ]
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
+
+class PostScheduler:
+    """Hand out messages to post as soon as their grouping window has closed."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.running = True
+
+    def schedule(self, msg, deadline):
+        """Schedule message to be posted at deadline (monotonic time).
+
+        Scheduling a message again replaces its earlier deadline.
+        """
+        with self.condition:
+            msg.post_sequence = next(self.counter)
+            heapq.heappush(self.heap, (deadline, msg.post_sequence, msg))
+            self.condition.notify()
+
+    def stop(self):
+        """Wake up and stop the waiting post thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def __len__(self):
+        with self.condition:
+            return sum(1 for _, sequence, msg in self.heap if sequence == msg.post_sequence)
+
+    def is_idle(self):
+        """Check if no messages are waiting to be posted."""
+        with self.condition:
+            return all(sequence != msg.post_sequence for _, sequence, msg in self.heap)
+
+    def get(self):
+        """Wait for the next message due for posting, return None when stopped."""
+        with self.condition:
+            while self.running:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline, sequence, msg = self.heap[0]
+                if sequence != msg.post_sequence:
+                    # Replaced by a later schedule
+                    heapq.heappop(self.heap)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                return msg
+            return None
+
+
+class MessageBuffer:
+    """Recently received messages, the oldest message is dropped when full.
+
+    Messages are indexed by fingerprint, so finding an earlier copy of a
+    message doesn't need a search through the buffer.
+    """
+
+    def __init__(self, capacity=100):
+        self.lock = threading.Lock()
+        self.messages = collections.deque()
+        self.capacity = capacity
+        self.index = {}
+
+    def __len__(self):
+        with self.lock:
+            return len(self.messages)
+
+    def add(self, msg):
+        """Add message, drop the oldest message when full."""
+        key = message_fingerprint(msg.body)
+        with self.lock:
+            if len(self.messages) >= self.capacity:
+                oldest = self.messages.popleft()
+                oldest_key = message_fingerprint(oldest.body)
+                if self.index.get(oldest_key) is oldest:
+                    del self.index[oldest_key]
+            self.messages.append(msg)
+            self.index[key] = msg
+
+    def find(self, body):
+        """Return the newest message with this body, None if there is none."""
+        with self.lock:
+            return self.index.get(message_fingerprint(body))
+
+
+class TTLCache:
+    """Dict with entries that expire ttl seconds after they are set.
+
+    When more than maxsize entries are stored the oldest entry is dropped.
+    """
+
+    def __init__(self, ttl, maxsize=1000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get(self, key):
+        """Return value of key, None if unknown or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if time.monotonic() > expires:
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        """Set value of key, expired and oldest entries are dropped."""
+        now = time.monotonic()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (now + self.ttl, value)
+            # Entries are ordered by expiry time
+            while self.entries:
+                expires, _ = next(iter(self.entries.values()))
+                if expires >= now and len(self.entries) <= self.maxsize:
+                    break
+                self.entries.popitem(last=False)
+
+
+class GeocodeCache:
+    """Geocode results stored in an SQLite database.
+
+    Addresses OpenCage couldn't find are stored too, so they are not looked
+    up again until negative_ttl (days) has passed. Found addresses expire
+    after ttl days.
+    """
+
+    def __init__(self, parent, filename, ttl=365, negative_ttl=7):
+        self.logger = parent.logger
+        self.filename = f"{datadir}/{filename}"
+        self.ttl = ttl * 86400
+        self.negative_ttl = negative_ttl * 86400
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.logger.info("Opening geocode cache '{}'".format(self.filename))
+        self.connection = sqlite3.connect(self.filename, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "address TEXT PRIMARY KEY, latitude TEXT, longitude TEXT, "
+                "url TEXT, found INTEGER, updated REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def import_csv(self, filename):
+        """Import the old GPS database file, only done once."""
+        filename = f"{datadir}/{filename}"
+        with self.lock:
+            imported = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'csv_imported'"
+            ).fetchone()
+        if imported or not os.path.isfile(filename):
+            return
+
+        try:
+            self.logger.info("Importing data from '{}'".format(filename))
+            now = time.time()
+            with open(filename, "r") as csv_file:
+                rows = [
+                    (row["address"], row["latitude"], row["lontitude"], row["url"], now)
+                    for row in csv.DictReader(csv_file)
+                    if row.get("address")
+                ]
+            with self.lock, self.connection:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO geocode VALUES (?, ?, ?, ?, 1, ?)", rows
+                )
+                self.connection.execute(
+                    "INSERT INTO meta VALUES ('csv_imported', ?)", (str(now),)
+                )
+            self.logger.info("{} records imported".format(len(rows)))
+        except KeyError:
+            self.logger.error(f"Could not parse file contents of: {filename}")
+        except OSError:
+            self.logger.error(f"Could not open/read file: {filename}")
+
+    def get(self, address):
+        """Return (found, latitude, longitude, url) for address, None if unknown or expired."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT latitude, longitude, url, found, updated FROM geocode "
+                "WHERE address = ?",
+                (address,),
+            ).fetchone()
+            if row is not None:
+                latitude, longitude, url, found, updated = row
+                ttl = self.ttl if found else self.negative_ttl
+                if time.time() - updated <= ttl:
+                    if found:
+                        self.hits += 1
+                        return True, latitude, longitude, url
+                    self.negative_hits += 1
+                    return False, "", "", ""
+            self.misses += 1
+            return None
+
+    def store(self, address, latitude, longitude, url):
+        """Store geocode result of address."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, 1, ?)",
+                (address, str(latitude), str(longitude), url, time.time()),
+            )
+
+    def store_missing(self, address):
+        """Store that address could not be found."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, '', '', '', 0, ?)",
+                (address, time.time()),
+            )
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.connection.close()
+
+
+class GeocodeWorker:
+    """Look up addresses with OpenCage in background threads.
+
+    Lookups for the same address are done once, every waiting callback gets
+    the result. Results are stored in the geocode cache.
+    """
+
+    def __init__(self, parent, token, cache, workers=1, queue_size=100):
+        self.logger = parent.logger
+        self.metrics = parent.metrics
+        self.token = token
+        self.cache = cache
+        self.disabled = False
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = [
+            threading.Thread(
+                name=f"GeocodeThread{number}", target=self.worker_call, daemon=True
+            )
+            for number in range(workers)
+        ]
+
+    def start(self):
+        """Start worker threads."""
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stop worker threads after running lookups."""
+        for _ in self.threads:
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def lookup(self, address, callback):
+        """Queue address lookup, callback(result) is called when done.
+
+        Returns False when the queue is full.
+        """
+        with self.lock:
+            if address in self.pending:
+                self.pending[address].append(callback)
+                return True
+            try:
+                self.queue.put_nowait(address)
+            except queue.Full:
+                self.logger.warning(f"Geocode queue full, skipping lookup of {address}")
+                self.metrics.inc("p2000_geocode_dropped_total")
+                return False
+            self.pending[address] = [callback]
+        return True
+
+    def geocode(self, address):
+        """Look up address, return (found, latitude, longitude, url) or None on errors."""
+        if self.disabled:
+            self.metrics.inc("p2000_geocode_requests_total", result="ratelimited")
+            return None
+        geocoder = OpenCageGeocode(self.token)
+        started = time.perf_counter()
+        try:
+            gps = geocoder.geocode(address, countrycode="nl")
+            self.metrics.observe("p2000_geocode_seconds", time.perf_counter() - started)
+            if gps:
+                latitude = gps[0]["geometry"]["lat"]
+                longitude = gps[0]["geometry"]["lng"]
+                mapurl = gps[0]["annotations"]["OSM"]["url"]
+                self.logger.debug(f"OpenCage results: {latitude}, {longitude}, {mapurl}")
+                self.cache.store(address, latitude, longitude, mapurl)
+                self.metrics.inc("p2000_geocode_requests_total", result="found")
+                return True, latitude, longitude, mapurl
+            self.cache.store_missing(address)
+            self.metrics.inc("p2000_geocode_requests_total", result="not_found")
+            return False, "", "", ""
+        # Rate-error check from opencage
+        except RateLimitExceededError as rle:
+            self.logger.error(rle)
+            # Over rate, opencage check disabled
+            self.disabled = True
+            self.metrics.inc("p2000_geocode_requests_total", result="ratelimited")
+            return None
+        except InvalidInputError as ex:
+            self.logger.error(ex)
+        except Exception as e:
+            self.logger.error(f"OpenCage lookup of {address} failed: {e}")
+        self.metrics.inc("p2000_geocode_requests_total", result="error")
+        return None
+
+    def worker_call(self):
+        """Thread for looking up addresses."""
+        while True:
+            address = self.queue.get()
+            if address is None:
+                break
+            result = self.geocode(address)
+            with self.lock:
+                callbacks = self.pending.pop(address, [])
+            for callback in callbacks:
+                callback(result)
+
+
+class FileWatcher:
+    """Call a function when a watched file has changed.
+
+    Uses inotify on Linux, otherwise modification times are checked every
+    interval seconds. Callbacks run in the watcher thread, delay seconds
+    after the last change so files are completely written.
+    """
+
+    # inotify event flags and struct inotify_event without name
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, logger, interval=5, delay=0.5):
+        self.logger = logger
+        self.interval = interval
+        self.delay = delay
+        self.callbacks = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            name="WatchThread", target=self.watch_thread_call, daemon=True
+        )
+
+    def watch(self, filename, callback):
+        """Call callback() when filename changes."""
+        self.callbacks[os.path.abspath(filename)] = callback
+
+    def start(self):
+        """Start watching in the background."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop watching."""
+        self.stopped.set()
+
+    def inotify_init(self):
+        """Return inotify file descriptor and watch descriptors of all directories."""
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        directories = {}
+        for directory in {os.path.dirname(filename) for filename in self.callbacks}:
+            wd = libc.inotify_add_watch(fd, directory.encode(), mask)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch {directory} failed")
+            directories[wd] = directory
+        return fd, directories
+
+    def notify(self, filenames):
+        """Call the callbacks of changed files, once per callback."""
+        callbacks = []
+        for filename in filenames:
+            callback = self.callbacks[filename]
+            if callback not in callbacks:
+                callbacks.append(callback)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as err:
+                self.logger.error(f"Reload after file change failed: {err}")
+
+    def watch_thread_call(self):
+        """Thread for watching files."""
+        try:
+            fd, directories = self.inotify_init()
+        except (OSError, AttributeError) as err:
+            self.logger.info(f"Checking files for changes every {self.interval}s ({err})")
+            self.poll()
+            return
+
+        self.logger.debug("Watching files with inotify")
+        changed = {}
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([fd], [], [], self.delay if changed else 1)
+                if ready:
+                    data = os.read(fd, 65536)
+                    offset = 0
+                    while offset < len(data):
+                        wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+                        offset += self.EVENT.size
+                        name = data[offset : offset + length].rstrip(b"\0").decode()
+                        offset += length
+                        filename = os.path.join(directories.get(wd, ""), name)
+                        if filename in self.callbacks:
+                            changed[filename] = time.monotonic()
+                due = [
+                    filename
+                    for filename, when in changed.items()
+                    if time.monotonic() - when >= self.delay
+                ]
+                for filename in due:
+                    del changed[filename]
+                if due:
+                    self.notify(due)
+        finally:
+            os.close(fd)
+
+    def poll(self):
+        """Check modification times until stopped."""
+
+        def stat(filename):
+            try:
+                result = os.stat(filename)
+                return result.st_mtime_ns, result.st_size
+            except OSError:
+                return None
+
+        stats = {filename: stat(filename) for filename in self.callbacks}
+        while not self.stopped.wait(self.interval):
+            due = []
+            for filename in self.callbacks:
+                current = stat(filename)
+                if current != stats[filename]:
+                    stats[filename] = current
+                    # A removed file is not a change, keep the loaded data
+                    if current is not None:
+                        due.append(filename)
+            if due:
+                self.notify(due)
+
+
+class IngestPipeline:
+    """One RTL-SDR and multimon-ng process, its lines are put on a shared queue.
+
+    The process is restarted with exponential backoff when it exits, and killed
+    and restarted when it gives no output for stall_timeout seconds.
+    """
+
+    # Longest partial line kept while waiting for its newline
+    MAX_LINE = 65536
+
+    def __init__(
+        self, logger, name, cmd, lines, metrics, stall_timeout=300, max_backoff=300
+    ):
+        self.logger = logger
+        self.name = name
+        self.cmd = cmd
+        self.lines = lines
+        self.metrics = metrics
+        self.stall_timeout = stall_timeout
+        self.max_backoff = max_backoff
+        self.process = None
+        self.stalled = False
+        self.last_line = time.monotonic()
+        self.stderr = collections.deque(maxlen=10)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            name=f"Ingest-{name}", target=self.read_thread_call, daemon=True
+        )
+
+    def start(self):
+        """Start the thread running the process."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop the process and don't restart it."""
+        self.stopping.set()
+        self.kill()
+
+    def kill(self):
+        """Kill the process and its pipeline, the shell started it in its own session."""
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def check(self):
+        """Kill the process if it gave no output for too long, it is restarted."""
+        if (
+            self.stall_timeout > 0
+            and self.process is not None
+            and self.process.poll() is None
+            and time.monotonic() - self.last_line > self.stall_timeout
+        ):
+            self.logger.error(
+                f"Ingest '{self.name}' gave no output for {self.stall_timeout}s, restarting"
+            )
+            self.stalled = True
+            self.kill()
+
+    def stderr_thread_call(self, stream):
+        """Thread keeping the last lines of stderr, so they can be logged on failure."""
+        for line in iter(stream.readline, b""):
+            self.stderr.append(line.decode("utf8", "backslashreplace").rstrip())
+        stream.close()
+
+    def run(self):
+        """Run the process until it exits, put its lines on the queue."""
+        self.stderr.clear()
+        self.stalled = False
+        self.last_line = time.monotonic()
+        self.process = subprocess.Popen(
+            self.cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=True,
+            start_new_session=True,
+        )
+        stderr_thread = threading.Thread(
+            name=f"Ingest-{self.name}-stderr",
+            target=self.stderr_thread_call,
+            args=(self.process.stderr,),
+            daemon=True,
+        )
+        stderr_thread.start()
+        self.metrics.set("p2000_ingest_up", 1, source=self.name)
+        with self.process.stdout:
+            # Read whatever is available and drop lines that are no FLEX ALN messages
+            fd = self.process.stdout.fileno()
+            pending = b""
+            dropping = False
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                self.last_line = time.monotonic()
+                started = time.perf_counter()
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                if dropping and lines:
+                    # Rest of a dropped line up to its newline
+                    lines.pop(0)
+                    dropping = False
+                if dropping or len(pending) > self.MAX_LINE:
+                    # Output without newlines is no multimon-ng line, drop it
+                    if not dropping:
+                        self.logger.warning(
+                            f"Ingest '{self.name}' dropped a line over {self.MAX_LINE} bytes"
+                        )
+                        self.metrics.inc("p2000_ingest_lines_total", source=self.name)
+                        self.metrics.inc("p2000_lines_total", type="other")
+                        dropping = True
+                    pending = b""
+                frames = [line for line in lines if is_flex_aln(line)]
+                self.metrics.inc(
+                    "p2000_ingest_lines_total", len(lines), source=self.name
+                )
+                self.metrics.inc(
+                    "p2000_lines_total", len(lines) - len(frames), type="other"
+                )
+                for line in frames:
+                    self.lines.put((self.name, line))
+                self.metrics.observe(
+                    "p2000_stage_seconds", time.perf_counter() - started, stage="read"
+                )
+            if pending:
+                self.metrics.inc("p2000_ingest_lines_total", source=self.name)
+                if is_flex_aln(pending):
+                    self.lines.put((self.name, pending))
+                else:
+                    self.metrics.inc("p2000_lines_total", type="other")
+        self.metrics.set("p2000_ingest_up", 0, source=self.name)
+        returncode = self.process.wait()
+        stderr_thread.join(timeout=1)
+        return returncode
+
+    def read_thread_call(self):
+        """Thread running the process, restarts it when it stops."""
+        backoff = 1
+        while not self.stopping.is_set():
+            self.logger.info(f"Ingest '{self.name}' started with: {self.cmd}")
+            started = time.monotonic()
+            try:
+                returncode = self.run()
+            except OSError as err:
+                returncode = err
+            if self.stopping.is_set():
+                break
+            failed = time.monotonic()
+
+            # Reset the backoff when the process ran fine for a while
+            if failed - started > self.max_backoff:
+                backoff = 1
+            reason = "stalled" if self.stalled else f"exit code {returncode}"
+            self.logger.error(
+                f"Ingest '{self.name}' stopped ({reason}), restarting in {backoff:g}s"
+            )
+            for line in self.stderr:
+                self.logger.error(f"Ingest '{self.name}' stderr: {line}")
+            self.metrics.inc("p2000_ingest_restarts_total", source=self.name)
+            self.stopping.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            self.metrics.inc(
+                "p2000_ingest_downtime_seconds_total",
+                time.monotonic() - failed,
+                source=self.name,
+            )
+        self.logger.debug(f"Ingest '{self.name}' stopped")
+
+
+def load_ingest(self, config):
+    """Return (name, cmd) of all ingest sections, or of the rtl-sdr section if there are none."""
+    pipelines = []
+    for section in config.sections():
+        if not section.startswith("ingest_"):
+            continue
+        if not config.getboolean(section, "enabled", fallback=True):
+            continue
+        cmd = config.get(section, "cmd", fallback="")
+        if not cmd:
+            self.logger.error(f"No cmd for {section}, ignoring it")
+            continue
+        pipelines.append((section.replace("ingest_", ""), cmd))
+    if not pipelines:
+        pipelines.append(("rtl-sdr", config.get("rtl-sdr", "cmd")))
+    return pipelines
+
+
+class ReplaySource:
+    """Recorded multimon-ng output, replayed at the pace of the FLEX timestamps.
+
+    speed scales the pace (e.g. 50 replays 50 times faster than real-time),
+    a speed of 0 replays as fast as possible.
+    """
+
+    def __init__(self, filename, speed=1.0):
+        self.filename = filename
+        self.speed = speed
+
+    def timestamp(self, line):
+        """Return FLEX timestamp of line in seconds, None if it has none."""
+        try:
+            return calendar.timegm(
+                time.strptime(line.split(b"|")[1].decode(), "%Y-%m-%d %H:%M:%S")
+            )
+        except (IndexError, ValueError, UnicodeDecodeError):
+            return None
+
+    def __iter__(self):
+        if self.filename == "-":
+            stream = sys.stdin.buffer
+        else:
+            stream = open(self.filename, "rb")
+
+        first = None
+        started = time.monotonic()
+        with stream:
+            for line in stream:
+                if self.speed > 0 and line.startswith(b"FLEX|"):
+                    timestamp = self.timestamp(line)
+                    if timestamp is not None:
+                        if first is None:
+                            first = timestamp
+                            started = time.monotonic()
+                        delay = (
+                            started + (timestamp - first) / self.speed - time.monotonic()
+                        )
+                        if delay > 0:
+                            time.sleep(delay)
+                yield line
+
+
+class DryRunRecorder:
+    """Record posts as JSON lines instead of sending them to Home Assistant or MQTT."""
+
+    def __init__(self, logger, filename):
+        self.logger = logger
+        self.lock = threading.Lock()
+        if filename == "-":
+            self.stream = sys.stdout
+        else:
+            self.stream = open(filename, "a")
+        self.logger.info(f"Dry run, recording posts to: {filename}")
+
+    def record(self, sink, target, data):
+        """Write one post."""
+        line = json.dumps({"time": time.time(), "sink": sink, "target": target, "data": data})
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def post_states(self, posts):
+        """Record Home Assistant posts of a message."""
+        for sensor, payload in posts:
+            self.record("home-assistant", sensor.entity_url, json.loads(payload))
+        return [True] * len(posts)
+
+    def publish(self, topic, payload):
+        """Record MQTT publish."""
+        self.record("mqtt", topic, payload.decode())
+
+    def stop(self):
+        """Close output file."""
+        with self.lock:
+            if self.stream is not sys.stdout:
+                self.stream.close()
 
 
 def load_config(filename):
     """Create default or load existing config file."""
     config = configparser.ConfigParser()
-    filename = f"{datadir}/{filename}"
+    filename = os.path.join(datadir, filename)
 
     if config.read(filename):
 
@@ -197,7 +1409,20 @@ def load_config(filename):
 
         return config
 
-    config["main"] = {"debug": False, "logtofile": False}
+    config["main"] = {
+        "debug": False,
+        "logtofile": False,
+        "post_delay": 1.0,
+        "message_history": 100,
+        "aggregate_window": 10,
+        "repeat_mode": "update",
+        "repeat_horizon": 600,
+        "watch_files": True,
+        "watch_interval": 5,
+        "ingest_window": 2,
+        "ingest_stall_timeout": 300,
+        "ingest_max_backoff": 300,
+    }
     config["rtl-sdr"] = {
         "cmd": "rtl_fm -f 169.65M -M fm -s 22050 | multimon-ng -a FLEX -t raw -"
     }
@@ -205,6 +1430,8 @@ def load_config(filename):
         "enabled": True,
         "baseurl": "http://homeassistant.local:8123",
         "token": "Place your Long-Lived Access Token here",
+        "workers": 4,
+        "timeout": 10,
     }
     config["mqtt"] = {
         "enabled": False,
@@ -213,10 +1440,23 @@ def load_config(filename):
         "mqtt_user": "mqttuser",
         "mqtt_password": "somepassword",
         "mqtt_topic": "p2000",
+        "mqtt_qos": 0,
+        "mqtt_queue_size": 1000,
     }
     config["opencage"] = {
         "enabled": False,
         "token": "Place your OpenCage API Token here",
+        "cache_ttl": 365,
+        "cache_negative_ttl": 7,
+        "workers": 1,
+        "queue_size": 100,
+        "budget": 5,
+    }
+    config["metrics"] = {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 9477,
+        "hass_interval": 0,
     }
     config["sensor_p2000"] = {
         "zone_latitude": "52.37602835336776",
@@ -286,6 +1526,146 @@ def load_capcodes_dict(self, filename):
     return capcodes
 
 
+class CapcodeDB:
+    """Capcode database compiled by convert/tools/gen_db_capcodes_bin.py.
+
+    The file is memory-mapped and capcodes are found with a binary search,
+    so nothing has to be loaded at startup. Lookups return the same dicts
+    as load_capcodes_dict.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as db_file:
+            self.map = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, field_count, self.strings = CAPCODE_DB_HEADER.unpack_from(
+            self.map, 0
+        )
+        if magic != CAPCODE_DB_MAGIC:
+            self.map.close()
+            raise ValueError(f"{filename} is not a compiled capcode database")
+        self.record = struct.Struct(f"<{field_count}I")
+        self.fields = tuple(
+            self.string(string_id)
+            for string_id in self.record.unpack_from(self.map, CAPCODE_DB_HEADER.size)
+        )
+        self.capcodes = CAPCODE_DB_HEADER.size + self.record.size
+        self.records = self.capcodes + UINT32.size * self.count
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, capcode):
+        return self.find(capcode) >= 0
+
+    def __getitem__(self, capcode):
+        index = self.find(capcode)
+        if index < 0:
+            raise KeyError(capcode)
+        string_ids = self.record.unpack_from(
+            self.map, self.records + index * self.record.size
+        )
+        return dict(zip(self.fields, map(self.string, string_ids)))
+
+    def get(self, capcode, default=None):
+        """Return info of capcode, default if unknown."""
+        try:
+            return self[capcode]
+        except KeyError:
+            return default
+
+    def string(self, string_id):
+        """Return string from the string table."""
+        start = self.strings + string_id
+        (length,) = UINT16.unpack_from(self.map, start)
+        start += UINT16.size
+        return self.map[start : start + length].decode("utf8")
+
+    def find(self, capcode):
+        """Return position of capcode, -1 if unknown."""
+        if len(capcode) != 9 or not capcode.isdigit():
+            return -1
+        value = int(capcode)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if UINT32.unpack_from(self.map, self.capcodes + middle * UINT32.size)[0] < value:
+                low = middle + 1
+            else:
+                high = middle
+        if (
+            low < self.count
+            and UINT32.unpack_from(self.map, self.capcodes + low * UINT32.size)[0] == value
+        ):
+            return low
+        return -1
+
+    def close(self):
+        """Unmap the file."""
+        self.map.close()
+
+
+def write_capcodes_db(filename, fields, records):
+    """Write compiled capcode database, records is a dict of capcode: values.
+
+    Capcodes are stored as numbers, so they have to be 9 digits to be unique.
+    """
+    strings = bytearray()
+    string_ids = {}
+
+    def intern(text):
+        if text not in string_ids:
+            data = text.encode("utf8")
+            if len(data) > 0xFFFF:
+                # Cut at a character boundary
+                data = data[:0xFFFF].decode("utf8", "ignore").encode("utf8")
+            string_ids[text] = len(strings)
+            strings.extend(UINT16.pack(len(data)) + data)
+        return string_ids[text]
+
+    record = struct.Struct(f"<{len(fields)}I")
+    field_ids = record.pack(*map(intern, fields))
+    for capcode in records:
+        if len(capcode) != 9 or not capcode.isdigit():
+            raise ValueError(f"capcode '{capcode}' is not 9 digits")
+    capcodes = sorted(records, key=int)
+    values = bytearray()
+    for capcode in capcodes:
+        row = list(records[capcode][: len(fields)])
+        row += [""] * (len(fields) - len(row))
+        values.extend(record.pack(*map(intern, row)))
+
+    offset = CAPCODE_DB_HEADER.size + len(field_ids) + UINT32.size * len(capcodes) + len(values)
+    tmpfile = filename + ".tmp"
+    with open(tmpfile, "wb") as db_file:
+        db_file.write(CAPCODE_DB_HEADER.pack(CAPCODE_DB_MAGIC, len(capcodes), len(fields), offset))
+        db_file.write(field_ids)
+        db_file.write(struct.pack(f"<{len(capcodes)}I", *map(int, capcodes)))
+        db_file.write(values)
+        db_file.write(strings)
+    # Replace at once, a running receiver keeps its mapping of the old file
+    os.replace(tmpfile, filename)
+    return len(capcodes)
+
+
+def load_capcodes_db(self, filename, textfile):
+    """Open compiled capcode database, fall back to loading the text file."""
+    dbfile = f"{datadir}/{filename}"
+    textpath = f"{datadir}/{textfile}"
+    if os.path.isfile(dbfile):
+        if os.path.isfile(textpath) and os.path.getmtime(dbfile) < os.path.getmtime(textpath):
+            self.logger.warning(
+                f"'{dbfile}' is older than '{textpath}', run convert/tools/gen_db_capcodes_bin.py"
+            )
+        else:
+            try:
+                capcodes = CapcodeDB(dbfile)
+                self.logger.info(f"Opened '{dbfile}', {len(capcodes)} capcodes")
+                return capcodes
+            except (OSError, ValueError, struct.error) as err:
+                self.logger.error(f"Could not open '{dbfile}': {err}")
+    return load_capcodes_dict(self, textfile)
+
+
 def load_capcodes_filter_dict(self, filename):
     """Load capcodes ignore or match data to dictionary."""
     capcodes = dict()
@@ -295,7 +1675,8 @@ def load_capcodes_filter_dict(self, filename):
         with open(filename, "r") as text_file:
             lines = text_file.readlines()
             for item in lines:
-                if item[0] == "#":
+                item = item.strip()
+                if not item or item[0] == "#":
                     continue
 
                 fields = item.split(",")
@@ -313,6 +1694,11 @@ def load_capcodes_filter_dict(self, filename):
     return capcodes
 
 
+def load_capcodes_filter(self, filename):
+    """Load capcodes ignore or match data and compile it to a FilterMatcher."""
+    return compile_filter(load_capcodes_filter_dict(self, filename))
+
+
 def load_list(self, filename):
     """Load data in list."""
     tmplist = []
@@ -340,31 +1726,1016 @@ def load_list(self, filename):
     return tmplist
 
 
-def check_filter(mylist, text):
+class FilterMatcher:
+    """Glob filter list compiled into a single matcher.
+
+    Entries without wildcards go into a set, entries of the form 'prefix*'
+    into a prefix trie, all other patterns are combined into one regex.
+    Matching follows fnmatch.fnmatch semantics for every entry.
+    """
+
+    _TERMINAL = ""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.exact = set()
+        self.prefixes = []
+        self.trie = {}
+        self.match_all = False
+        self.regex = None
+
+        globs = []
+        for pattern in self.patterns:
+            if not any(char in pattern for char in "*?["):
+                self.exact.add(pattern)
+            elif pattern.endswith("*") and not any(
+                char in pattern[:-1] for char in "*?["
+            ):
+                self.add_prefix(pattern[:-1])
+            else:
+                globs.append(pattern)
+
+        if globs:
+            self.regex = re.compile(
+                "|".join(f"(?:{fnmatch.translate(glob)})" for glob in globs)
+            )
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add_prefix(self, prefix):
+        """Add a 'prefix*' entry to the prefix trie."""
+        if not prefix:
+            self.match_all = True
+            return
+        self.prefixes.append(prefix)
+        node = self.trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[self._TERMINAL] = True
+
+    def match_prefix(self, text):
+        """Check if text starts with one of the 'prefix*' entries."""
+        node = self.trie
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                return False
+            if self._TERMINAL in node:
+                return True
+        return False
+
+    def match(self, text):
+        """Check if text matches at least one entry."""
+        if self.match_all or text in self.exact:
+            return True
+        if self.trie and self.match_prefix(text):
+            return True
+        if self.regex is not None and self.regex.match(text):
+            return True
+        return False
+
+    def match_any(self, texts):
+        """Check if at least one of texts matches an entry."""
+        if not self.exact.isdisjoint(texts):
+            return True
+        if self.match_all or self.trie or self.regex is not None:
+            return any(self.match(text) for text in texts)
+        return False
+
+    def match_every(self, texts):
+        """Check if there are texts and all of them match an entry."""
+        if not texts:
+            return False
+        if self.exact.issuperset(texts):
+            return True
+        return all(self.match(text) for text in texts)
+
+
+def compile_filter(patterns):
+    """Compile a list of glob patterns to a FilterMatcher."""
+    return FilterMatcher(patterns)
+
+
+def load_filter(self, filename):
+    """Load glob patterns from file and compile them to a FilterMatcher."""
+    return compile_filter(load_list(self, filename))
+
+
+def compile_filter_option(value):
+    """Compile a comma separated config option value to a FilterMatcher."""
+    return FilterMatcher(value.split(","))
+
+
+def check_filter(matcher, text):
     """Check filter data."""
     # If list is not loaded or empty allow all
-    if len(mylist) == 0:
+    if len(matcher) == 0:
         return True
 
     # Check if text applied matches at least one filter
-    for f_str in mylist:
-        if fnmatch.fnmatch(text, f_str):
-            return True
+    return matcher.match(text)
 
-    return False
 
-
-def check_filter_with_list(searchlist, list_to_be_searched):
+def check_filter_with_list(matcher, list_to_be_searched):
+    """Check if at least one text of the list matches the filter."""
     # If list is not loaded or empty allow all
-    if len(searchlist) == 0:
+    if len(matcher) == 0:
         return True
 
-    # Check every text in the searchedlist
-    for searchedtext in list_to_be_searched:
-        if check_filter(searchlist, searchedtext) == True:
-            return True
+    return matcher.match_any(list_to_be_searched)
+
+
+class CityMatcher:
+    """Aho-Corasick automaton to find all city names in a message in one pass."""
+
+    def __init__(self, names):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        # Build the trie of city names
+        for name in names:
+            node = 0
+            for char in name:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            if name and name not in self.output[node]:
+                self.output[node].append(name)
+
+        # Add failure links breadth first
+        pending = collections.deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self.goto[node].items():
+                pending.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    @staticmethod
+    def is_word_char(char):
+        """Check if character is part of a word."""
+        return char.isalnum() or char == "_"
+
+    def is_bounded(self, text, start, end):
+        """Check if there is a word boundary \\b before and after text[start:end]."""
+
+        def is_word_at(pos):
+            return 0 <= pos < len(text) and self.is_word_char(text[pos])
+
+        if is_word_at(start - 1) == is_word_at(start):
+            return False
+        return is_word_at(end - 1) != is_word_at(end)
+
+    def findall(self, text):
+        """Return (start, end, name) of all city names found, in message order.
+
+        Names inside a longer name are found too, like 'Bergen' in 'Bergen op Zoom'.
+        """
+        matches = []
+        node = 0
+        for pos, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for name in self.output[node]:
+                start = pos + 1 - len(name)
+                if self.is_bounded(text, start, pos + 1):
+                    matches.append((start, pos + 1, name))
+        matches.sort()
+        return matches
+
+
+class Sensor(
+    collections.namedtuple(
+        "Sensor",
+        [
+            "name",
+            "friendly_name",
+            "zone",
+            "radius",
+            "keyword",
+            "region",
+            "capcode",
+            "discipline",
+            "entity_url",
+            "mqtt_topic",
+        ],
+    )
+):
+    """Sensor definition compiled from a sensor_ section of the config file."""
 
-    return False
+    __slots__ = ()
+
+
+def load_sensors(self, config):
+    """Compile all sensor sections of the config to Sensor objects."""
+    sensors = []
+    for section in config.sections():
+        # Each section is a sensor
+        if not section.startswith("sensor_"):
+            continue
+
+        name = section.replace("sensor_", "")
+        options = config.options(section)
+        try:
+            zone = None
+            radius = None
+            if "zone_radius" in options:
+                zone = (
+                    float(config.get(section, "zone_latitude")),
+                    float(config.get(section, "zone_longitude")),
+                )
+                if config.get(section, "zone_radius"):
+                    radius = float(config.get(section, "zone_radius"))
+        except (ValueError, configparser.Error) as err:
+            self.logger.error(f"Invalid zone for sensor {name}, ignoring sensor: {err}")
+            continue
+
+        filters = {}
+        for option in ["searchkeyword", "searchregion", "searchcapcode", "searchdiscipline"]:
+            if option in options:
+                filters[option] = compile_filter_option(config.get(section, option))
+            else:
+                filters[option] = None
+
+        sensors.append(
+            Sensor(
+                name=name,
+                friendly_name=config.get(section, "friendlyname", fallback="P2000-SDR"),
+                zone=zone,
+                radius=radius,
+                keyword=filters["searchkeyword"],
+                region=filters["searchregion"],
+                capcode=filters["searchcapcode"],
+                discipline=filters["searchdiscipline"],
+                entity_url=self.baseurl + "/api/states/sensor." + name,
+                mqtt_topic=self.mqtt_topic + "/sensor/" + name,
+            )
+        )
+    self.logger.info("{} sensors loaded".format(len(sensors)))
+    return tuple(sensors)
+
+
+def match_sensor(sensor, msg, distance=None):
+    """Check if message has to be posted to sensor.
+
+    Distance to the zone can be passed in when it is already calculated.
+    Returns a (matched, distance, reason) tuple, reason tells why the message
+    was ignored for this sensor.
+    """
+    post = False
+
+    # If location is known and radius is specified in config calculate distance and check radius
+    if msg.latitude and msg.longitude and sensor.radius is not None:
+        if distance is None:
+            distance = round(
+                geopy.distance.geodesic(
+                    sensor.zone, (msg.latitude, msg.longitude)
+                ).km,
+                2,
+            )
+        if distance > sensor.radius:
+            return False, distance, "distance outside radius"
+        post = True
+
+    else:
+        distance = ""
+
+    # Check for matched text/keyword
+    if sensor.keyword is not None:
+        if not check_filter(sensor.keyword, msg.body):
+            return False, distance, "didn't match keyword"
+        post = True
+
+    # Check for matched regions
+    if sensor.region is not None:
+        if not check_filter(sensor.region, msg.region):
+            return False, distance, "didn't match region"
+        post = True
+
+    # Check for matched capcodes
+    if sensor.capcode is not None:
+        if not check_filter_with_list(sensor.capcode, msg.capcodes):
+            return False, distance, "didn't match capcode"
+        post = True
+
+    # Check for matched disciplines
+    if sensor.discipline is not None:
+        if not check_filter(sensor.discipline, msg.disciplines):
+            return False, distance, "didn't match discipline"
+        post = True
+
+    # No other matches valid, if distance is not valid, skip
+    if post is False:
+        return False, distance, "no post criteria"
+
+    return True, distance, ""
+
+
+class ZoneTable:
+    """Coordinates and radius of all zone sensors, to check them all at once.
+
+    Distances are calculated with a vectorized haversine formula, zones whose
+    bounding box doesn't contain the location are skipped when prefilter is
+    enabled. Set exact to use geodesic distances for the remaining zones.
+    """
+
+    EARTH_RADIUS = 6371.0088
+    KM_PER_DEGREE = 111.2
+
+    def __init__(self, zones, exact=False, prefilter=True):
+        self.exact = exact
+        self.prefilter = prefilter
+        self.zones = list(zones)
+        self.latitude = numpy.array([zone[0] for zone in self.zones], dtype=float)
+        self.longitude = numpy.array([zone[1] for zone in self.zones], dtype=float)
+        self.radius = numpy.array([zone[2] for zone in self.zones], dtype=float)
+        self.latitude_rad = numpy.radians(self.latitude)
+        self.longitude_rad = numpy.radians(self.longitude)
+        self.cos_latitude = numpy.cos(self.latitude_rad)
+
+        # Bounding box half sizes in degrees, with a small margin
+        margin = self.radius * 1.01 + 0.001
+        self.box_latitude = margin / self.KM_PER_DEGREE
+        self.box_longitude = margin / (
+            self.KM_PER_DEGREE * numpy.maximum(self.cos_latitude, 1e-6)
+        )
+
+    def __len__(self):
+        return len(self.zones)
+
+    def distances(self, latitude, longitude):
+        """Return distance in km to every zone, NaN for zones outside bounding box."""
+        result = numpy.full(len(self.zones), numpy.nan)
+        if self.prefilter:
+            rows = numpy.nonzero(
+                (numpy.abs(self.latitude - latitude) <= self.box_latitude)
+                & (numpy.abs(self.longitude - longitude) <= self.box_longitude)
+            )[0]
+        else:
+            rows = numpy.arange(len(self.zones))
+
+        if self.exact:
+            for row in rows:
+                result[row] = geopy.distance.geodesic(
+                    (self.latitude[row], self.longitude[row]), (latitude, longitude)
+                ).km
+            return result
+
+        latitude_rad = numpy.radians(latitude)
+        longitude_rad = numpy.radians(longitude)
+        hav = (
+            numpy.sin((self.latitude_rad[rows] - latitude_rad) / 2) ** 2
+            + numpy.cos(latitude_rad)
+            * self.cos_latitude[rows]
+            * numpy.sin((self.longitude_rad[rows] - longitude_rad) / 2) ** 2
+        )
+        result[rows] = 2 * self.EARTH_RADIUS * numpy.arcsin(numpy.sqrt(hav))
+        return result
+
+
+class SensorRouter:
+    """Find the sensors a message has to be posted to.
+
+    Sensors are indexed on their capcode, region or discipline filter when
+    it only contains exact or 'prefix*' entries, so only sensors that can
+    match a message are evaluated. Sensors without an indexable filter, like
+    keyword and radius only sensors, are evaluated for every message.
+    """
+
+    def __init__(self, sensors, exact_distance=False, distance_prefilter=True):
+        self.sensors = sensors
+        self.zone_rows = {}
+        self.capcodes = {}
+        self.capcode_prefixes = {}
+        self.regions = {}
+        self.disciplines = {}
+        self.fallback = []
+
+        for pos, sensor in enumerate(sensors):
+            keys = self.capcode_keys(sensor.capcode)
+            if keys is not None:
+                exact, prefixes = keys
+                for capcode in exact:
+                    self.capcodes.setdefault(capcode, []).append(pos)
+                for prefix in prefixes:
+                    self.add_prefix(prefix, pos)
+            elif self.is_exact(sensor.region):
+                for region in sensor.region.exact:
+                    self.regions.setdefault(region, []).append(pos)
+            elif self.is_exact(sensor.discipline):
+                for discipline in sensor.discipline.exact:
+                    self.disciplines.setdefault(discipline, []).append(pos)
+            else:
+                self.fallback.append(pos)
+
+        # Collect zones of all radius sensors in one table
+        zones = []
+        for pos, sensor in enumerate(sensors):
+            if sensor.radius is not None:
+                self.zone_rows[pos] = len(zones)
+                zones.append((sensor.zone[0], sensor.zone[1], sensor.radius))
+        self.zones = ZoneTable(
+            zones, exact=exact_distance, prefilter=distance_prefilter
+        )
+
+    def __len__(self):
+        return len(self.sensors)
+
+    @staticmethod
+    def is_exact(matcher):
+        """Check if filter only contains entries without wildcards."""
+        return (
+            matcher is not None
+            and len(matcher) > 0
+            and matcher.regex is None
+            and not matcher.prefixes
+            and not matcher.match_all
+        )
+
+    @staticmethod
+    def capcode_keys(matcher):
+        """Return exact capcodes and prefixes of a capcode filter, None if not indexable."""
+        if matcher is None or len(matcher) == 0 or matcher.match_all:
+            return None
+
+        exact = set(matcher.exact)
+        for pattern in matcher.patterns:
+            if pattern in exact or (pattern.endswith("*") and pattern[:-1] in matcher.prefixes):
+                continue
+            # Capcodes are always 9 digits, so '*000120901*' can only match itself
+            core = pattern.strip("*")
+            if len(core) == 9 and core.isdigit():
+                exact.add(core)
+                continue
+            return None
+        return exact, matcher.prefixes
+
+    def add_prefix(self, prefix, pos):
+        """Add sensor to the capcode prefix trie."""
+        node = self.capcode_prefixes
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault("", []).append(pos)
+
+    def find_prefixes(self, capcode):
+        """Return sensors with a capcode prefix that matches capcode."""
+        found = []
+        node = self.capcode_prefixes
+        for char in capcode:
+            node = node.get(char)
+            if node is None:
+                break
+            found.extend(node.get("", ()))
+        return found
+
+    def candidates(self, msg):
+        """Return positions of sensors that could match the message, in config order."""
+        positions = set(self.fallback)
+        for capcode in msg.capcodes:
+            positions.update(self.capcodes.get(capcode, ()))
+            if self.capcode_prefixes:
+                positions.update(self.find_prefixes(capcode))
+        positions.update(self.regions.get(msg.region, ()))
+        positions.update(self.disciplines.get(msg.disciplines, ()))
+        return sorted(positions)
+
+    def route(self, msg):
+        """Evaluate candidate sensors, return (sensor, matched, distance, reason) tuples."""
+        positions = self.candidates(msg)
+
+        # Calculate distance to all zones in one pass
+        distances = None
+        if msg.latitude and msg.longitude and any(
+            pos in self.zone_rows for pos in positions
+        ):
+            distances = self.zones.distances(float(msg.latitude), float(msg.longitude))
+
+        result = []
+        for pos in positions:
+            sensor = self.sensors[pos]
+            distance = None
+            if distances is not None and pos in self.zone_rows:
+                distance = distances[self.zone_rows[pos]]
+                if numpy.isnan(distance):
+                    result.append((sensor, False, "", "distance outside radius"))
+                    continue
+                distance = round(float(distance), 2)
+            matched, distance, reason = match_sensor(sensor, msg, distance)
+            result.append((sensor, matched, distance, reason))
+        return result
+
+
+# Priority codes and their level
+PRIO_LEVELS = {
+    "A1": 1,
+    "P1": 1,
+    "PRIO1": 1,
+    "A2": 2,
+    "P2": 2,
+    "PRIO2": 2,
+    "B1": 3,
+    "B2": 3,
+    "B3": 3,
+    "P3": 3,
+    "PRIO3": 3,
+    "P4": 4,
+    "PRIO4": 4,
+}
+# Codes that can be followed by the city, case sensitive
+PRIO_LOCATION = {"A1", "A2", "B1", "B2", "B3", "P1", "P2", "PRIO1", "PRIO2"}
+# Codes that are followed by the city or removed anywhere in a message,
+# the others only at the start
+PRIO_LOCATION_ANYWHERE = {"A2", "B1", "PRIO1", "PRIO2"}
+# Words followed by a ride or ticket number, matched at the end of a word
+# like the old regex that had no \b before them
+REFERENCE_WORDS = ("rit:", "rit", "bon:", "bon", "ambu", "dia")
+
+# Token kinds
+WORD = 0
+NUMBER = 1
+POSTCODE = 2
+POSTCODE4 = 3
+
+
+def is_word_char(char):
+    """Check if character is a word character, like \\w."""
+    return char.isalnum() or char == "_"
+
+
+def word_before(text):
+    """Return last character of text with the word characters before it, like (\\w*.)$."""
+    start = len(text) - 1
+    while start > 0 and is_word_char(text[start - 1]):
+        start -= 1
+    return text[start:]
+
+
+def word_after(text):
+    """Return first character of text with the word characters after it, like ^(.\\w*)."""
+    end = 1
+    while end < len(text) and is_word_char(text[end]):
+        end += 1
+    return text[:end]
+
+
+def count_digits(text, maximum=None):
+    """Return number of ascii digits at the start of text."""
+    count = 0
+    for char in text[:maximum]:
+        if char not in string.digits:
+            break
+        count += 1
+    return count
+
+
+def classify_token(token):
+    """Return the kind of a token."""
+    if not token[:1].isdigit() or not token.isascii():
+        return WORD
+    if token[0] != "0":
+        if len(token) == 4 and token.isdigit():
+            return POSTCODE4
+        if len(token) == 6 and token[:4].isdigit() and token[4:].isalpha():
+            return POSTCODE
+    if token.isdigit():
+        return NUMBER
+    return WORD
+
+
+def prio_code(tokens, index):
+    """Return (tokens, code) of a priority code at index or None, 'P 1' is two tokens."""
+    upper = tokens[index].upper()
+    if upper in ("A", "B", "P", "PRIO"):
+        if index + 1 < len(tokens) and tokens[index + 1] in ("1", "2", "3", "4"):
+            return 2, upper + tokens[index + 1]
+    elif upper in PRIO_LEVELS:
+        return 1, upper
+    return None
+
+
+def prio_words(message):
+    """Return the words of message a priority code is looked for in.
+
+    Splits on any whitespace, '/' and '-' and strips punctuation around the
+    words, so codes like 'A1:', '(A1)', 'P1-BRT' and 'A2/A1' are found.
+    """
+    words = []
+    for word in message.replace("/", " ").replace("-", " ").split():
+        word = word.strip(string.punctuation)
+        if word:
+            words.append(word)
+    return words
+
+
+def uppercase_words(tokens):
+    """Return all runs of two or more uppercase letters, like [A-Z]{2,}."""
+    found = []
+    for token in tokens:
+        if token[1:] == token[1:].lower():
+            continue
+        if token.isascii() and token.isalpha() and token.isupper():
+            if len(token) >= 2:
+                found.append(token)
+            continue
+        start = None
+        for pos, char in enumerate(token + " "):
+            if char in string.ascii_uppercase:
+                if start is None:
+                    start = pos
+            else:
+                if start is not None and pos - start >= 2:
+                    found.append(token[start:pos])
+                start = None
+    return found
+
+
+def remove_repeated_words(text):
+    """Remove words that occur again later in text, like (\\b\\S+\\b)(?=.*\\1).
+
+    A word runs from a word boundary to the furthest word boundary before a
+    space for which it is found again, str.find instead of a lookahead.
+    """
+    parts = []
+    start = 0
+    for chunk in text.split(" "):
+        end = start + len(chunk)
+        if chunk.isalnum():
+            # Only the whole chunk can be a word
+            parts.append(chunk if text.find(chunk, end) < 0 else "")
+        else:
+            word = [is_word_char(char) for char in chunk]
+            word.append(False)
+            kept = pos = 0
+            piece = []
+            while pos < len(chunk):
+                if chunk[pos].isspace() or word[pos] == (pos > 0 and word[pos - 1]):
+                    pos += 1
+                    continue
+                stop = pos
+                while stop < len(chunk) and not chunk[stop].isspace():
+                    stop += 1
+                while stop > pos:
+                    if word[stop] != word[stop - 1]:
+                        if text.find(chunk[pos:stop], start + stop) >= 0:
+                            break
+                    stop -= 1
+                if stop > pos:
+                    piece.append(chunk[kept:pos])
+                    kept = pos = stop
+                else:
+                    pos += 1
+            piece.append(chunk[kept:])
+            parts.append("".join(piece))
+        start = end + 1
+    return " ".join(parts)
+
+
+class MessageTokens:
+    """Message split on spaces, with the kind of every token and the priority codes.
+
+    codes holds (index, tokens, code) for every priority code that is a token
+    of its own, in upper case, for the address parser. levels holds the level
+    of every priority code in the words of prio_words().
+    """
+
+    __slots__ = ("tokens", "kinds", "codes", "levels")
+
+    def __init__(self, message):
+        self.tokens = message.split(" ")
+        self.kinds = [classify_token(token) for token in self.tokens]
+        self.codes = []
+        for index, token in enumerate(self.tokens):
+            if len(token) <= 5:
+                code = prio_code(self.tokens, index)
+                if code:
+                    self.codes.append((index, *code))
+        words = prio_words(message)
+        self.levels = []
+        for index, word in enumerate(words):
+            if len(word) <= 5:
+                code = prio_code(words, index)
+                if code:
+                    self.levels.append(PRIO_LEVELS[code[1]])
+
+    def priority(self):
+        """Return the lowest priority level found, 0 if there is none."""
+        return min(self.levels, default=0)
+
+
+class AddressParser:
+    """Extract street, postal code and city from the tokens of a message.
+
+    Takes the same steps as the regexes it replaces: postal code with letters,
+    postal code without letters, city after the priority, uppercase city
+    abbreviation and as last resort a city name in what is left after removing
+    codes and numbers.
+    """
+
+    def __init__(self, logger, plaatsnamen, pltsnmn):
+        self.logger = logger
+        self.plaatsnamen = set(plaatsnamen)
+        self.pltsnmn = pltsnmn
+        self.citymatcher = CityMatcher(plaatsnamen)
+        # Position of every city name in db_plaatsnamen.txt
+        self.order = {name: index for index, name in enumerate(plaatsnamen)}
+
+    def parse(self, message, tokens=None):
+        """Return (message, street, postalcode, city, address).
+
+        Uppercase city abbreviations in the returned message are removed or
+        replaced by the city name.
+        """
+        if tokens is None:
+            tokens = MessageTokens(message)
+        words = tokens.tokens
+        kinds = tokens.kinds
+        postalcode = ""
+        city = ""
+        address = ""
+        street = ""
+
+        # Get address info if any, look for valid postalcode and get the two words around them
+        # A2 (DIA: ja) AMBU 17106 Schiedamseweg 3134BA Vlaardingen VLAARD bon 8576
+        found = self.find_postcode(words, kinds, POSTCODE)
+        if found:
+            street, postalcode, city = found
+            address = f"{street} {postalcode} {city}"
+            # Remove Capitalized city name from message (when postalcode is found)
+            words = self.remove_abbreviations(words)
+            if words is not tokens.tokens:
+                kinds = [classify_token(word) for word in words]
+
+        # Get address in info if any, look for valid postalcode without letters and get the two words around them
+        # A1 13108 Surinameplein 1058 Amsterdam 12006
+        found = self.find_postcode(words, kinds, POSTCODE4)
+        if found:
+            street, postalcode, city = found
+            address = f"{street} {city}"
+            words = self.remove_abbreviations(words)
+
+        # Try to get city only when there is one after a prio
+        # A1 Breda
+        else:
+            location = self.find_prio_location(words, tokens.codes)
+            if location in self.plaatsnamen:
+                city = location
+            else:
+                # Find all uppercase words and check if there is a valid city name amoung them
+                # A2 Ambulancepost Moordrecht Middelweg MOORDR V
+                for afkorting in uppercase_words(words):
+                    if afkorting not in self.pltsnmn:
+                        continue
+                    city = self.pltsnmn[afkorting]["plaatsnaam"]
+                    # If uppercase city is found, grab first word before that city name, since it's likely to be the streetname
+                    for index in range(1, len(words)):
+                        if words[index].startswith(afkorting):
+                            before = " ".join(words[:index])
+                            if before:
+                                street = word_before(before)
+                                break
+                    address = f"{street} {city}"
+                    # Change uppercase city to normal city in message
+                    words = [word.replace(afkorting, city) for word in words]
+
+            # If no address is found, do a wild guess
+            if not address:
+                strip = remove_repeated_words(self.strip_message(words))
+                # Search in leftover message for a city corresponding to City list.
+                # Like the loop over all city names this replaces, the first
+                # place of a city with a word before it is used, and of several
+                # cities the one last in db_plaatsnamen.txt.
+                found = None
+                for start, end, plaatsnaam in self.citymatcher.findall(strip):
+                    if found and self.order[plaatsnaam] <= self.order[found[1]]:
+                        continue
+                    self.logger.debug("City found: " + plaatsnaam)
+                    # Find first word left from city, ending with a letter and a space.
+                    # Kept as the old regex \w*.[a-z|A-Z] \b did it for the same
+                    # results: its class also allows "|" and its "." is no newline.
+                    before = strip[:start]
+                    if (
+                        len(before) >= 3
+                        and before[-1] == " "
+                        and before[-2] in string.ascii_letters + "|"
+                        and before[-3] != "\n"
+                    ):
+                        found = (start, plaatsnaam)
+                if found:
+                    start, city = found
+                    before = strip[:start]
+                    addr = word_before(before[:-2]) + before[-2:] + city
+                    # Final non address symbols strip
+                    address = self.strip_address(addr)
+                    self.logger.debug("Adress found: " + address)
+
+        return " ".join(words), street, postalcode, city, address
+
+    @staticmethod
+    def find_postcode(words, kinds, kind):
+        """Return (street, postalcode, city) around the first postal code of kind."""
+        for index in range(1, len(words) - 1):
+            if kinds[index] == kind:
+                before = " ".join(words[:index])
+                after = " ".join(words[index + 1 :])
+                if before and after:
+                    return word_before(before), words[index], word_after(after)
+        return None
+
+    def remove_abbreviations(self, words):
+        """Remove uppercase city abbreviations, words is returned if there are none."""
+        for afkorting in uppercase_words(words):
+            if afkorting in self.pltsnmn:
+                words = [word.replace(afkorting, "") for word in words]
+        return words
+
+    @staticmethod
+    def find_prio_location(words, codes):
+        """Return the word after the first priority code that can precede a city."""
+        for index, count, code in codes:
+            if index and code not in PRIO_LOCATION_ANYWHERE:
+                continue
+            # Location codes are case sensitive and have to be followed by a word
+            if code not in PRIO_LOCATION:
+                continue
+            if "".join(words[index : index + count]) != code:
+                continue
+            after = " ".join(words[index + count :])
+            if after:
+                return word_after(after)
+        return ""
+
+    @staticmethod
+    def strip_message(words):
+        """Return message without priority codes, ride numbers and remarks.
+
+        Removed text leaves an empty piece, so the spaces around it stay like
+        they did with the regex. Glue joins the next piece to the previous one,
+        for a removed ' : ' and the space before A2.
+        """
+        pieces = []
+        glue = False
+        index = 0
+        while index < len(words):
+            word = words[index]
+            lower = word.lower()
+            piece = None
+            code = prio_code(words, index) if len(word) <= 5 else None
+            if code and (index == 0 and not pieces or code[1] in PRIO_LOCATION_ANYWHERE):
+                # Priority with the number after it, or everything up to BR
+                rest = " ".join(words[index + code[0] :])
+                if index + code[0] < len(words):
+                    rest = " " + rest
+                digits = 0
+                if rest and not is_word_char(rest[0]):
+                    digits = count_digits(rest[1:])
+                if digits >= 2:
+                    rest = rest[digits + 1 :]
+                else:
+                    # Greedy .*(BR)\b with re.I, so the last "br" at a word end
+                    end = rest.lower().rfind("br")
+                    while end >= 0 and end + 2 < len(rest) and is_word_char(rest[end + 2]):
+                        end = rest.lower().rfind("br", 0, end + 1)
+                    if end >= 0:
+                        rest = rest[end + 2 :]
+                # Also remove the space before A2, the old regex had \s?A\s?2
+                glue = glue or code[1] == "A2" and bool(pieces)
+                words = rest.split(" ")
+                piece = words[0]
+                index = 1
+            elif word == ":" and pieces and not glue and index + 1 < len(words):
+                # The old regex removed " : " with both spaces
+                glue = True
+                index += 1
+                continue
+            elif (
+                lower.endswith(REFERENCE_WORDS)
+                and index + 1 < len(words)
+                and count_digits(words[index + 1], 8) >= 5
+            ):
+                # Ride or ticket number, \W\d{5,8} so at most 8 digits are removed
+                reference = next(ref for ref in REFERENCE_WORDS if lower.endswith(ref))
+                digits = count_digits(words[index + 1], 8)
+                piece = word[: -len(reference)] + words[index + 1][digits:]
+                index += 2
+            elif "(" in word:
+                # Remark between brackets, with the number after it
+                start = word.index("(")
+                end = word.find(")", start + 1)
+                if end > start + 1:
+                    piece = word[:start] + word[end + 1 :]
+                    index += 1
+                    if end + 1 == len(word) and index < len(words):
+                        digits = count_digits(words[index])
+                        if digits >= 5:
+                            piece += words[index][digits:]
+                            index += 1
+                else:
+                    rest = " ".join(words[index:])[start:]
+                    end = rest.find(")", 1)
+                    if end > 1 and rest.find("\n", 0, end) < 0:
+                        rest = rest[end + 1 :]
+                        digits = count_digits(rest[1:]) if rest[:1] == " " else 0
+                        if digits >= 5:
+                            rest = rest[digits + 1 :]
+                        words = rest.split(" ")
+                        piece = word[:start] + words[0]
+                        index = 1
+            elif lower.endswith("directe") and index + 1 < len(words):
+                after = words[index + 1]
+                piece = word[:-7] + after[len(word_after(" " + after)) - 1 :]
+                index += 2
+            if piece is None:
+                piece = word
+                if index == len(words) - 1:
+                    # Number of 5 or more digits at the end, \b\d{5,}$
+                    digits = len(word) - len(word.rstrip(string.digits))
+                    if digits >= 5 and not is_word_char((" " + word)[-digits - 1]):
+                        piece = word[:-digits]
+                index += 1
+            if glue:
+                pieces[-1] += piece
+                glue = False
+            else:
+                pieces.append(piece)
+        # The old regex ended in (-)+/gi, a leftover that only matched a literal
+        # "-/gi", so dashes are not removed here
+        return " ".join(pieces).strip(" \t")
+
+    @staticmethod
+    def strip_address(addr):
+        """Remove '- ' and a word character followed by a digit and a space."""
+        result = []
+        pos = 0
+        while pos < len(addr):
+            if addr.startswith("- ", pos):
+                pos += 2
+            elif (
+                pos + 2 < len(addr)
+                and is_word_char(addr[pos])
+                and addr[pos + 1] in string.digits
+                and addr[pos + 2] == " "
+            ):
+                pos += 3
+            else:
+                result.append(addr[pos])
+                pos += 1
+        return "".join(result)
+
+
+def p2000_get_capcode_info(capcodesdb, capcodes, location=""):
+    """Return (receiver, discipline, region, location, remark) of the capcodes."""
+    for capcode in capcodes:
+        info = capcodesdb.get(capcode)
+        if info is not None:
+            receiver = "{} ({})".format(info["description"], capcode)
+            discipline = "{}".format(info["discipline"])
+            region = info["region"]
+            location = info["location"]
+            remark = info["remark"]
+        else:
+            receiver = capcode
+            discipline = ""
+            region = ""
+            remark = ""
+
+    return receiver, discipline, region, location, remark
+
+
+def is_flex_aln(line):
+    """Quick check on bytes if a line of multimon-ng output can be a FLEX ALN message."""
+    return line.startswith(b"FLEX|") and b"|ALN|" in line
+
+
+def split_flex_line(line):
+    """Split a FLEX ALN line at its first six separators, without decoding it.
+
+    multimon-ng writes FLEX|timestamp|baud/level/phase|cycle.frame|capcodes|ALN|message,
+    returns (timestamp, groupid, capcodes, message) as bytes or None for other lines.
+    The message is kept whole, also when it contains a separator.
+    """
+    fields = line.split(b"|", 6)
+    if len(fields) != 7 or fields[0] != b"FLEX" or fields[5] != b"ALN":
+        return None
+    return fields[1], fields[3].strip(), fields[4].strip(), fields[6].strip()
+
+
+def parse_flex_line(line):
+    """Split a decoded FLEX ALN line, return (timestamp, groupid, capcodes, message) or None."""
+    fields = line.split("|", 6)
+    if len(fields) != 7 or fields[0] != "FLEX" or fields[5] != "ALN":
+        return None
+    return fields[1], fields[3].strip(), fields[4].strip(), fields[6].strip()
 
 
 def to_local_datetime(utc_dt):
@@ -373,25 +2744,11 @@ def to_local_datetime(utc_dt):
     return time.ctime(calendar.timegm(time_tuple))
 
 
-def p2000_get_prio(message):
-    """Look for priority strings and return level."""
-    priority = 0
-
-    regex_prio1 = r"^A\s?1|\s?A\s?1|PRIO\s?1|^P\s?1"
-    regex_prio2 = r"^A\s?2|\s?A\s?2|PRIO\s?2|^P\s?2"
-    regex_prio3 = r"^B\s?1|^B\s?2|^B\s?3|PRIO\s?3|^P\s?3"
-    regex_prio4 = r"^PRIO\s?4|^P\s?4"
-
-    if re.search(regex_prio1, message, re.IGNORECASE):
-        priority = 1
-    elif re.search(regex_prio2, message, re.IGNORECASE):
-        priority = 2
-    elif re.search(regex_prio3, message, re.IGNORECASE):
-        priority = 3
-    elif re.search(regex_prio4, message, re.IGNORECASE):
-        priority = 4
-
-    return priority
+def p2000_get_prio(message, tokens=None):
+    """Look for priority codes and return level."""
+    if tokens is None:
+        tokens = MessageTokens(message)
+    return tokens.priority()
 
 
 # Log all messages send or ignored to a logfile in folder logfiles
@@ -404,37 +2761,89 @@ def log2file(logmessage):
     return
 
 
-# Set and change to program directory
-datadir = os.path.dirname(os.path.realpath(__file__))
-os.chdir(datadir)
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="RTL-SDR P2000 Receiver for Home Assistant."
+    )
+    parser.add_argument(
+        "--config",
+        default=CFGFILE,
+        help=f"config file to use (default {CFGFILE})",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="read recorded multimon-ng output from FILE ('-' for stdin) instead of RTL-SDR",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay speed, e.g. 50 for 50x real-time, 0 for as fast as possible (default 1.0)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        metavar="FILE",
+        help="record posts to FILE ('-' for stdout) instead of sending them",
+    )
+    return parser.parse_args()
 
-# Load configuration
-config = load_config(CFGFILE)
 
-# Init logging
-logger = Logger(datadir, 7, config.getboolean("main", "debug"))
+# Program directory, all data files are located here
+datadir = os.path.dirname(os.path.realpath(__file__))
 
 
 class Main:
     """Main class, start of application."""
 
-    def __init__(self):
+    def __init__(self, options):
         self.running = True
-        self.messages = []
+        self.options = options
 
         # Init logging
         self.logger = logger
         self.config = config
 
         if self.config:
-            self.logger.info(f"Loading configuration from '{CFGFILE}'")
+            self.logger.info(f"Loading configuration from '{options.config}'")
         else:
             self.logger.info(
-                f"Created config file '{CFGFILE}', edit it and restart the program."
+                f"Created config file '{options.config}', edit it and restart the program."
             )
 
         self.debug = self.config.getboolean("main", "debug")
         self.logtofile = self.config.getboolean("main", "logtofile")
+        self.post_delay = self.config.getfloat("main", "post_delay", fallback=1.0)
+        self.exact_distance = self.config.getboolean(
+            "main", "exact_distance", fallback=False
+        )
+        self.distance_prefilter = self.config.getboolean(
+            "main", "distance_prefilter", fallback=True
+        )
+        self.message_history = self.config.getint(
+            "main", "message_history", fallback=100
+        )
+        self.aggregate_window = self.config.getfloat(
+            "main", "aggregate_window", fallback=10
+        )
+        self.repeat_mode = self.config.get("main", "repeat_mode", fallback="update")
+        if self.repeat_mode not in ("suppress", "update"):
+            self.logger.error(
+                f"Invalid repeat_mode '{self.repeat_mode}', using 'update'"
+            )
+            self.repeat_mode = "update"
+        self.repeat_horizon = self.config.getfloat(
+            "main", "repeat_horizon", fallback=600
+        )
+        self.watch_files = self.config.getboolean("main", "watch_files", fallback=True)
+        self.watch_interval = self.config.getfloat(
+            "main", "watch_interval", fallback=5
+        )
+        self.repeats = None
+        if self.repeat_horizon > 0:
+            self.repeats = TTLCache(self.repeat_horizon, self.message_history * 10)
+        self.messages = MessageBuffer(self.message_history)
 
         # Set current folder so we can find the config files
         os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -444,32 +2853,30 @@ class Main:
             if not os.path.exists("logfiles"):
                 os.mkdir("logfiles")
 
-        # Check if GPS datafile is available
-        if not os.path.isfile("location_gps_database.csv"):
-            gps_data_fieldnames = ["address", "latitude", "lontitude", "url"]
-            with open("location_gps_database.csv", "w") as outfile:
-                writer = csv.DictWriter(
-                    outfile,
-                    fieldnames=gps_data_fieldnames,
-                    delimiter=",",
-                    quoting=csv.QUOTE_MINIMAL,
-                    lineterminator="\n",
-                )
-                writer.writeheader()
-            outfile.close()
-
         self.logger.info(f"RTL-SDR P2000 Receiver for Home Assistant Version {VERSION}")
         self.logger.info("Started at %s" % time.strftime("%A %H:%M:%S %d-%m-%Y"))
 
-        # Check if required software is installed
-        if not check_requirements(self):
+        # Check if required software is installed, not needed for replay
+        if not options.replay and not check_requirements(self):
             self.logger.error("Application stopped, required software was not found!")
             sys.exit(0)
 
-        self.rtlfm_cmd = self.config.get("rtl-sdr", "cmd")
+        self.ingest = load_ingest(self, self.config)
+        self.ingest_window = self.config.getfloat("main", "ingest_window", fallback=2)
+        self.frames = TTLCache(self.ingest_window, self.message_history * 10)
+        self.ingest_stall_timeout = self.config.getfloat(
+            "main", "ingest_stall_timeout", fallback=300
+        )
+        self.ingest_max_backoff = self.config.getfloat(
+            "main", "ingest_max_backoff", fallback=300
+        )
         self.use_hass = self.config.getboolean("home-assistant", "enabled")
         self.baseurl = self.config.get("home-assistant", "baseurl")
         self.token = self.config.get("home-assistant", "token")
+        self.hass_workers = self.config.getint("home-assistant", "workers", fallback=4)
+        self.hass_timeout = self.config.getfloat(
+            "home-assistant", "timeout", fallback=10
+        )
 
         self.use_mqtt = self.config.getboolean("mqtt", "enabled")
         self.mqtt_server = self.config.get("mqtt", "mqtt_server")
@@ -477,12 +2884,46 @@ class Main:
         self.mqtt_username = self.config.get("mqtt", "mqtt_user")
         self.mqtt_password = self.config.get("mqtt", "mqtt_password")
         self.mqtt_topic = self.config.get("mqtt", "mqtt_topic")
+        self.mqtt_qos = self.config.getint("mqtt", "mqtt_qos", fallback=0)
+        self.mqtt_queue_size = self.config.getint(
+            "mqtt", "mqtt_queue_size", fallback=1000
+        )
         self.use_opencage = self.config.getboolean("opencage", "enabled")
         self.opencagetoken = self.config.get("opencage", "token")
-        self.opencage_disabled = False
+        self.geocode_workers = self.config.getint("opencage", "workers", fallback=1)
+        self.geocode_queue_size = self.config.getint(
+            "opencage", "queue_size", fallback=100
+        )
+        self.geocode_budget = self.config.getfloat("opencage", "budget", fallback=5)
+        self.geocode_ttl = self.config.getfloat("opencage", "cache_ttl", fallback=365)
+        self.geocode_negative_ttl = self.config.getfloat(
+            "opencage", "cache_negative_ttl", fallback=7
+        )
+        self.use_metrics = self.config.getboolean("metrics", "enabled", fallback=False)
+        self.metrics_host = self.config.get("metrics", "host", fallback="127.0.0.1")
+        self.metrics_port = self.config.getint("metrics", "port", fallback=9477)
+        self.metrics_interval = self.config.getfloat(
+            "metrics", "hass_interval", fallback=0
+        )
+
+        # Pipeline metrics are always collected, served when enabled
+        self.metrics = Metrics()
+
+        # Compile sensor definitions and index them
+        self.router = SensorRouter(
+            load_sensors(self, self.config),
+            exact_distance=self.exact_distance,
+            distance_prefilter=self.distance_prefilter,
+        )
+        self.logger.info(
+            "{} sensors indexed, {} evaluated for every message".format(
+                len(self.router) - len(self.router.fallback),
+                len(self.router.fallback),
+            )
+        )
 
         # Load capcodes data
-        self.capcodes = load_capcodes_dict(self, "db_capcodes.txt")
+        self.capcodes = load_capcodes_db(self, "db_capcodes.bin", "db_capcodes.txt")
 
         # Load plaatsnamen data
         self.plaatsnamen = load_list(self, "db_plaatsnamen.txt")
@@ -490,26 +2931,147 @@ class Main:
         # Load plaatsnamen afkortingen data
         self.pltsnmn = load_capcodes_dict(self, "db_pltsnmn.txt")
 
+        # Address extraction uses plaatsnamen and afkortingen
+        self.addressparser = AddressParser(self.logger, self.plaatsnamen, self.pltsnmn)
+
         # Load capcodes ignore data
-        self.ignorecapcodes = load_capcodes_filter_dict(self, "ignore_capcodes.txt")
+        self.ignorecapcodes = load_capcodes_filter(self, "ignore_capcodes.txt")
 
         # Load text ignore data
-        self.ignoretext = load_list(self, "ignore_text.txt")
+        self.ignoretext = load_filter(self, "ignore_text.txt")
 
         # Load match text filter data
         # self.matchtext = load_list(self, "match_text.txt.example")
-        self.matchtext = load_list(self, "match_text.txt")
+        self.matchtext = load_filter(self, "match_text.txt")
 
         # Load match capcodes filter data
-        self.matchcapcodes = load_capcodes_filter_dict(self, "match_capcodes.txt")
+        self.matchcapcodes = load_capcodes_filter(self, "match_capcodes.txt")
+
+        # Reload filters, capcodes and sensors when their files change
+        self.watcher = None
+        if self.watch_files:
+            self.watcher = FileWatcher(self.logger, interval=self.watch_interval)
+            load_db = functools.partial(
+                load_capcodes_db, self, "db_capcodes.bin", "db_capcodes.txt"
+            )
+            for filename, attribute, load in (
+                ("ignore_capcodes.txt", "ignorecapcodes", load_capcodes_filter),
+                ("match_capcodes.txt", "matchcapcodes", load_capcodes_filter),
+                ("ignore_text.txt", "ignoretext", load_filter),
+                ("match_text.txt", "matchtext", load_filter),
+            ):
+                self.watch(filename, attribute, functools.partial(load, self, filename))
+            self.watch("db_capcodes.txt", "capcodes", load_db)
+            self.watch("db_capcodes.bin", "capcodes", load_db)
+            self.watch(options.config, "router", self.load_router)
+            self.watcher.start()
+
+        # Open geocode cache, import old GPS database file once
+        self.geocache = GeocodeCache(
+            self,
+            "geocode.db",
+            ttl=self.geocode_ttl,
+            negative_ttl=self.geocode_negative_ttl,
+        )
+        self.geocache.import_csv("location_gps_database.csv")
+        for result, attribute in (
+            ("hit", "hits"),
+            ("negative_hit", "negative_hits"),
+            ("miss", "misses"),
+        ):
+            self.metrics.set_function(
+                "p2000_geocode_cache_total",
+                functools.partial(getattr, self.geocache, attribute),
+                result=result,
+            )
 
-        # Load GPS database data
-        self.gpsdatabase = load_capcodes_dict(self, "location_gps_database.csv")
+        # Start geocoding threads
+        self.geocoder = None
+        if self.use_opencage:
+            self.geocoder = GeocodeWorker(
+                self,
+                self.opencagetoken,
+                self.geocache,
+                workers=self.geocode_workers,
+                queue_size=self.geocode_queue_size,
+            )
+            self.geocoder.start()
+            self.metrics.set_function(
+                "p2000_geocode_queue_depth", self.geocoder.queue.qsize
+            )
+            self.metrics.set_function(
+                "p2000_geocode_ratelimited", lambda: int(self.geocoder.disabled)
+            )
+
+        # Record posts instead of sending them
+        recorder = None
+        if options.dry_run:
+            recorder = DryRunRecorder(self.logger, options.dry_run)
+
+        # Pooled connections to Home Assistant
+        self.hass = None
+        if self.use_hass and recorder:
+            self.hass = recorder
+        elif self.use_hass:
+            self.hass = HassPoster(
+                self.logger,
+                self.token,
+                workers=self.hass_workers,
+                timeout=self.hass_timeout,
+                metrics=self.metrics,
+            )
+
+        # Start long-lived MQTT connection
+        self.mqtt = None
+        if self.use_mqtt and recorder:
+            self.mqtt = recorder
+        elif self.use_mqtt:
+            self.mqtt = MqttPublisher(
+                self.logger,
+                self.mqtt_server,
+                self.mqtt_port,
+                self.mqtt_username,
+                self.mqtt_password,
+                qos=self.mqtt_qos,
+                queue_size=self.mqtt_queue_size,
+                metrics=self.metrics,
+            )
+            self.mqtt.start()
+            self.metrics.set_function(
+                "p2000_mqtt_queue_depth", functools.partial(len, self.mqtt.queue)
+            )
+            self.metrics.set_function(
+                "p2000_mqtt_connected", lambda: int(self.mqtt.connected)
+            )
+
+        # Messages are posted when their grouping window closes
+        self.scheduler = PostScheduler()
+        self.metrics.set_function(
+            "p2000_pending_messages", functools.partial(len, self.scheduler)
+        )
 
         # Start thread to get data from RTL-SDR stick
         data_thread = threading.Thread(name="DataThread", target=self.data_thread_call)
         data_thread.start()
 
+        # Serve metrics and publish them to Home Assistant if requested
+        metrics_server = None
+        if self.use_metrics:
+            try:
+                metrics_server = MetricsServer(
+                    self.logger, self.metrics, self.metrics_host, self.metrics_port
+                )
+                metrics_server.start()
+            except OSError as err:
+                self.logger.error(
+                    f"Could not serve metrics on {self.metrics_host}:{self.metrics_port}: {err}"
+                )
+        if self.metrics_interval > 0 and self.hass:
+            metrics_thread = threading.Thread(
+                name="MetricsPostThread", target=self.metrics_thread_call, daemon=True
+            )
+            metrics_thread.start()
+
         # Start thread to post messages to Home Assistant
         post_thread = threading.Thread(name="PostThread", target=self.post_thread_call)
         post_thread.start()
@@ -518,616 +3080,532 @@ class Main:
         while True:
             try:
                 time.sleep(1)
+                # Stop when replay is done and everything is posted
+                if (
+                    options.replay
+                    and not data_thread.is_alive()
+                    and self.scheduler.is_idle()
+                ):
+                    self.logger.info("Replay finished")
+                    break
             except KeyboardInterrupt:
                 break
 
         # Application is interrupted and is stopping
         self.running = False
+        self.scheduler.stop()
+        post_thread.join()
+        if metrics_server:
+            metrics_server.stop()
+        if self.watcher:
+            self.watcher.stop()
+        if self.geocoder:
+            self.geocoder.stop()
+        if self.hass:
+            self.hass.stop()
+        if self.mqtt:
+            self.mqtt.stop()
+        self.logger.info(
+            f"Geocode cache: {self.geocache.hits} hits, {self.geocache.negative_hits} negative hits, {self.geocache.misses} misses"
+        )
+        self.geocache.close()
         self.logger.info("Application stopped")
 
     def post_data(self, msg):
-        # Loop through all sensors
-        for section in config.sections():
-            # Each section is a sensor
-            self.radius = ""
-            self.sensorname = ""
-            self.home_coordinates = ""
-            self.friendly_name = ""
-            self.searchkeyword = ""
-            self.searchcapcode = ""
-            self.searchregion = ""
-            post = False
-
-            if section.startswith("sensor_"):
-                self.sensorname = section.replace("sensor_", "")
-                if "zone_radius" in self.config.options(section):
-                    self.home_coordinates = (
-                        float(self.config.get(section, "zone_latitude")),
-                        float(self.config.get(section, "zone_longitude")),
-                    )
-                    self.radius = self.config.get(section, "zone_radius", fallback="")
-
-                msg.friendly_name = self.config.get(
-                    section, "friendlyname", fallback="P2000-SDR"
+        """Post data to Home Assistant via Rest API and/or MQTT topic."""
+        hass_posts = []
+        first_post = not msg.is_posted
+        new_sensors_only, msg.new_sensors_only = msg.new_sensors_only, False
+        posted = False
+        head = None
+
+        # Loop through all sensors that could match
+        started = time.perf_counter()
+        routes = msg.routes
+        if routes is None:
+            routes = msg.routes = self.router.route(msg)
+            self.metrics.observe(
+                "p2000_stage_seconds", time.perf_counter() - started, stage="route"
+            )
+        for sensor, matched, distance, reason in routes:
+            if distance != "":
+                self.logger.debug(
+                    f"Distance from home {distance} km, radius set to {sensor.radius} km"
                 )
-                self.searchkeyword = self.config.get(
-                    section, "searchkeyword", fallback=""
-                ).split(",")
-                self.searchcapcode = self.config.get(
-                    section, "searchcapcode", fallback=""
-                ).split(",")
-                self.searchregion = self.config.get(
-                    section, "searchregion", fallback=""
-                ).split(",")
-                self.searchdiscipline = self.config.get(
-                    section, "searchdiscipline", fallback=""
-                ).split(",")
-
-                # If location is known and radius is specified in config calculate distance and check radius
-                if msg.latitude and msg.longitude and self.radius:
-                    event_coordinates = (msg.latitude, msg.longitude)
-                    msg.distance = round(
-                        geopy.distance.geodesic(
-                            self.home_coordinates, event_coordinates
-                        ).km,
-                        2,
-                    )
-                    self.logger.debug(
-                        f"Distance from home {msg.distance} km, radius set to {self.radius} km"
-                    )
-                    if msg.distance > float(self.radius):
-                        self.logger.debug(
-                            f"Message '{msg.body}' ignored for sensor {self.sensorname} (distance outside radius)"
-                        )
-                        msg.is_posted = True
-                        continue
-                    post = True
+            # Mark as posted to prevent race conditions
+            msg.is_posted = True
+            if not matched:
+                self.logger.debug(
+                    f"Message '{msg.body}'{msg.capcodes} ignored for sensor {sensor.name} ({reason})"
+                )
+                continue
+            if new_sensors_only and sensor.name in msg.posted_sensors:
+                self.logger.debug(
+                    f"Message '{msg.body}' already posted for sensor {sensor.name}"
+                )
+                continue
+            msg.posted_sensors.add(sensor.name)
+            self.logger.debug(
+                f"Message '{msg.body}'{msg.capcodes} posted for sensor {sensor.name}"
+            )
+            posted = True
+
+            # If logging all messages to file is requested, log message
+            if self.logtofile:
+                logmessage = (
+                    "Posted"
+                    + " -|- "
+                    + msg.message_raw
+                    + " -|- "
+                    + sensor.name
+                    + " -|- "
+                    + msg.region
+                    + " -|- "
+                    + msg.mapurl
+                )
+                log2file(logmessage)
 
-                # Check for matched text/keyword
-                if "searchkeyword" in self.config.options(section):
-                    if not check_filter(self.searchkeyword, msg.body):
-                        self.logger.debug(
-                            f"Message '{msg.body}' ignored for sensor {self.sensorname} (didn't match keyword) - {self.searchkeyword}"
-                        )
-                        msg.is_posted = True
-                        continue
-                    self.logger.debug(
-                        f"Message '{msg.body}' posted for sensor {self.sensorname} (sensor succesfull match keyword) - {self.searchkeyword}"
-                    )
-                    post = True
+            # Serialize message once, only the sensor attributes differ
+            if head is None:
+                head = msg.payload_head()
+            payload = sensor_payload(head, distance, sensor.friendly_name)
 
-                # Check for matched regions
-                if "searchregion" in self.config.options(section):
-                    if not check_filter(self.searchregion, msg.region):
-                        self.logger.debug(
-                            f"Message '{msg.body}' ignored for sensor {self.sensorname} (didn't match region) - {self.searchregion}"
-                        )
-                        msg.is_posted = True
-                        continue
-                    self.logger.debug(
-                        f"Message '{msg.body}' posted for sensor {self.sensorname} (sensor succesfull match region) - {self.searchregion}"
-                    )
-                    post = True
+            if self.use_hass:
+                hass_posts.append((sensor, payload))
 
-                # Check for matched capcodes
-                if "searchcapcode" in self.config.options(section):
-                    if not check_filter_with_list(self.searchcapcode, msg.capcodes):
-                        self.logger.debug(
-                            f"Message '{msg.body}'{msg.capcodes} ignored for sensor {self.sensorname} (didn't match capcode) - {self.searchcapcode}"
-                        )
-                        msg.is_posted = True
-                        continue
-                    self.logger.debug(
-                        f"Message '{msg.body}'{msg.capcodes} posted for sensor {self.sensorname} (sensor succesfull match capcode) - {self.searchcapcode}"
-                    )
-                    post = True
+            if self.use_mqtt:
+                try:
+                    self.logger.debug("Posting to MQTT")
+                    self.mqtt.publish(sensor.mqtt_topic, payload)
 
-                # Check for matched disciplines
-                if "searchdiscipline" in self.config.options(section):
-                    if not check_filter(self.searchdiscipline, msg.disciplines):
-                        self.logger.debug(
-                            f"Message '{msg.body}'{msg.disciplines} ignored for sensor {self.sensorname} (didn't match discipline) - {self.searchdiscipline}"
-                        )
-                        msg.is_posted = True
-                        continue
                     self.logger.debug(
-                        f"Message '{msg.body}'{msg.disciplines} posted for sensor {self.sensorname} (sensor succesfull match discipline) - {self.searchdiscipline}"
+                        f"MQTT status: Posting to {self.mqtt_server}:{self.mqtt_port} topic:{sensor.mqtt_topic}"
                     )
-                    post = True
+                    self.logger.debug(f"MQTT json: {payload}")
+                except Exception as e:
+                    self.logger.debug(f"MQTT Crashed: {e}")
+
+        # Post to all matching Home Assistant sensors at once
+        if hass_posts:
+            self.hass.post_states(hass_posts)
+            self.logger.debug(f"OpenCage status: {msg.opencage}")
+
+        if posted and first_post:
+            self.metrics.observe(
+                "p2000_message_latency_seconds", time.monotonic() - msg.timereceived
+            )
+        self.metrics.observe(
+            "p2000_stage_seconds", time.perf_counter() - started, stage="post"
+        )
 
-                # No other matches valid, if distance is not valid, skip
-                if post is False:
-                    self.logger.debug(
-                        f"Message '{msg.body}' ignored for sensor {self.sensorname} (no post criteria)"
-                    )
-                    msg.is_posted = True
-                    continue
+    def metrics_thread_call(self):
+        """Thread for publishing metrics as Home Assistant sensor."""
+        sensor = Sensor(
+            name="p2000_metrics",
+            friendly_name="P2000 metrics",
+            zone=None,
+            radius=None,
+            keyword=None,
+            region=None,
+            capcode=None,
+            discipline=None,
+            entity_url=self.baseurl + "/api/states/sensor.p2000_metrics",
+            mqtt_topic=self.mqtt_topic + "/sensor/p2000_metrics",
+        )
+        next_post = time.monotonic() + self.metrics_interval
+        while self.running:
+            time.sleep(1)
+            if time.monotonic() < next_post:
+                continue
+            next_post += self.metrics_interval
+            summary = self.metrics.summary()
+            summary["friendly_name"] = sensor.friendly_name
+            data = {
+                "state": summary.get("messages_total_new", 0),
+                "attributes": summary,
+            }
+            payload = json.dumps(data, separators=(",", ":")).encode()
+            self.hass.post_states([(sensor, payload)])
+
+    def on_geocoded(self, msg, result):
+        """Hand coordinates to the post thread, post message again if it was already posted.
+
+        Runs in a geocode thread, the message is only changed by the post
+        thread in apply_geocoded.
+        """
+        # Without coordinates there is nothing to update in a posted message
+        if msg.is_posted and (result is None or not result[0]):
+            msg.geocode_pending = False
+            return
+        msg.geocoded = (result, self.geocoder.disabled)
+        msg.geocode_pending = False
+        if msg.is_posted:
+            self.logger.debug(f"Coordinates of '{msg.body}' arrived late, updating")
+            self.scheduler.schedule(msg, time.monotonic())
+        else:
+            self.scheduler.schedule(msg, max(time.monotonic(), msg.release_deadline))
+
+    def apply_geocoded(self, msg):
+        """Add coordinates from a geocode thread to message, in the post thread."""
+        geocoded, msg.geocoded = msg.geocoded, None
+        if geocoded is None:
+            return
+        result, ratelimit = geocoded
+        msg.gps_checked = result is not None
+        if msg.gps_checked:
+            found, msg.latitude, msg.longitude, msg.mapurl = result
+            msg.routes = None
+            # Update every sensor with the coordinates
+            msg.new_sensors_only = False
+        msg.opencage = f"enabled: {self.use_opencage} ratelimit: {ratelimit} gps-checked: {msg.gps_checked}"
 
-                # If logging all messages to file is requested, log message
+    def data_thread_call(self):
+        """Thread for parsing data from RTL-SDR."""
+        if self.options.replay:
+            self.logger.info(
+                f"Replaying multimon-ng output from: {self.options.replay} (speed {self.options.speed})"
+            )
+            for line in ReplaySource(self.options.replay, self.options.speed):
+                if not self.running:
+                    break
+                self.process_line(line, "replay")
+            self.logger.debug("Data thread stopped")
+            return
+
+        # Every pipeline reads its own dongle, all lines are processed here in order
+        lines = queue.Queue()
+        pipelines = [
+            IngestPipeline(
+                self.logger,
+                name,
+                cmd,
+                lines,
+                self.metrics,
+                self.ingest_stall_timeout,
+                self.ingest_max_backoff,
+            )
+            for name, cmd in self.ingest
+        ]
+        for pipeline in pipelines:
+            pipeline.start()
+        next_check = 0
+        while self.running:
+            # Restart pipelines that stopped giving output
+            if time.monotonic() >= next_check:
+                for pipeline in pipelines:
+                    pipeline.check()
+                next_check = time.monotonic() + 1
+            try:
+                source, line = lines.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.process_line(line, source)
+
+        for pipeline in pipelines:
+            pipeline.stop()
+        self.logger.debug("Data thread stopped")
+
+    def process_line(self, line, source="rtl-sdr"):
+        """Parse one line of multimon-ng output read by ingest pipeline source."""
+        timereceived = time.monotonic()
+        started = time.perf_counter()
+        frame = split_flex_line(line)
+        if frame:
+            # A corrupt timestamp makes the whole line unusable
+            try:
+                timestamp = to_local_datetime(frame[0].decode("ascii"))
+            except ValueError:
+                self.logger.debug(f"Line with invalid FLEX timestamp ignored: {line}")
+                frame = None
+        self.metrics.inc("p2000_lines_total", type="flex" if frame else "other")
+        if frame:
+            # Same frame received by another dongle, only remember it heard it too
+            sources = self.frames.get(frame)
+            if sources is not None and source not in sources:
+                sources.append(source)
+                self.metrics.inc("p2000_ingest_duplicates_total", source=source)
+                return
+            sources = [source]
+            self.frames.set(frame, sources)
+
+            # Check capcodes first, before the message is decoded and parsed
+            capcode_list = frame[2].decode("ascii", "replace").split()
+            matchcapcodes = self.matchcapcodes
+            ignorecapcodes = self.ignorecapcodes
+            rule = None
+            if len(matchcapcodes) and not matchcapcodes.match_any(capcode_list):
+                rule = "match_capcodes"
+            elif (
+                capcode_list
+                and len(ignorecapcodes)
+                and ignorecapcodes.match_every(capcode_list)
+            ):
+                rule = "ignore_capcodes"
+            if rule:
+                self.logger.debug(
+                    f"Message for capcodes {capcode_list} ignored ({rule})"
+                )
+                self.metrics.inc("p2000_filtered_total", rule=rule)
+                self.metrics.inc("p2000_messages_total", result="ignored")
+                return
+
+            line = line.strip().decode("utf8", "backslashreplace")
+            _, groupid, capcodes, message = parse_flex_line(line)
+            # Split message once, for priority and address
+            tokens = MessageTokens(message)
+            priority = p2000_get_prio(message, tokens)
+            started = self.stage_done("parse", started)
+            location = ""
+            postalcode = ""
+            city = ""
+            address = ""
+            street = ""
+            longitude = ""
+            latitude = ""
+            opencage = ""
+            mapurl = ""
+            gpscheck = False
+
+            self.logger.debug(line)
+
+            # Check for ignore texts, an empty list ignores nothing
+            if len(self.ignoretext) and self.ignoretext.match(message):
+                self.logger.debug(
+                    f"Message '{message}' ignored (matched ignore_text)"
+                )
                 if self.logtofile:
-                    logmessage = (
-                        "Posted"
-                        + " -|- "
-                        + msg.message_raw
-                        + " -|- "
-                        + self.sensorname
-                        + " -|- "
-                        + msg.region
-                        + " -|- "
-                        + msg.mapurl
-                    )
+                    logmessage = "Ignore text" + " -|- " + line
                     log2file(logmessage)
+                self.metrics.inc("p2000_filtered_total", rule="ignore_text")
+                self.metrics.inc("p2000_messages_total", result="ignored")
+                return
+            started = self.stage_done("filter", started)
+
+            # Get address info if any
+            message, street, postalcode, city, address = self.addressparser.parse(
+                message, tokens
+            )
+            started = self.stage_done("address", started)
 
-                """Post data to Home Assistant via Rest API and/or MQTT topic."""
-                data = {
-                    "state": msg.body,
-                    "attributes": {
-                        "time received": msg.timestamp,
-                        "group id": msg.groupid,
-                        "receivers": msg.receivers,
-                        "capcodes": msg.capcodes,
-                        "priority": msg.priority,
-                        "disciplines": msg.disciplines,
-                        "raw message": msg.message_raw,
-                        "region": msg.region,
-                        "location": msg.location,
-                        "postal code": msg.postalcode,
-                        "city": msg.city,
-                        "address": msg.address,
-                        "street": msg.street,
-                        "remarks": msg.remarks,
-                        "longitude": msg.longitude,
-                        "latitude": msg.latitude,
-                        "opencage": msg.opencage,
-                        "mapurl": msg.mapurl,
-                        "distance": msg.distance,
-                        "friendly_name": msg.friendly_name,
-                    },
-                }
-                heartbeat = {
-                    "state": time.strftime("%Y%m%d"),
-                }
-
-                if self.use_hass:
-                    try:
+            # Get more info about the capcodes
+            receiver, discipline, region, location, remark = p2000_get_capcode_info(
+                self.capcodes, capcodes.split(" "), location
+            )
+            started = self.stage_done("capcodes", started)
+
+            # If this message was received within the aggregation window, only add extra info
+            previous = self.messages.find(message)
+            if previous is not None and (
+                not previous.is_posted
+                or timereceived - previous.timereceived <= self.aggregate_window
+            ):
+                changed = previous.merge(
+                    receiver, discipline, remark, region, capcodes.split(" ")
+                )
+                if changed:
+                    previous.routes = None
+                if not previous.is_posted:
+                    # Wait post_delay for more copies again, until the window closes
+                    previous.release_deadline = (
+                        min(timereceived, previous.timereceived + self.aggregate_window)
+                        + self.post_delay
+                    )
+                    self.scheduler.schedule(previous, previous.release_deadline)
+                elif changed:
+                    # Already posted, post to sensors it matches now when no more copies arrive
+                    self.logger.debug(f"More capcodes for '{previous.body}', updating")
+                    previous.new_sensors_only = True
+                    self.scheduler.schedule(previous, timereceived + self.post_delay)
+                previous.location = location
+                previous.postalcode = postalcode
+                previous.city = city
+                previous.street = street
+                previous.address = address
+                for name in sources:
+                    if name not in previous.sources:
+                        previous.sources.append(name)
+                self.frames.set(frame, previous.sources)
+                self.metrics.inc("p2000_messages_total", result="merged")
+            else:
+                # Alert repeated within the horizon, suppress it or reuse what is known
+                repeat = None
+                if self.repeats is not None:
+                    repeat = self.repeats.get(message_fingerprint(message))
+                    if repeat is not None and self.repeat_mode == "suppress":
                         self.logger.debug(
-                            f"Posting to Home Assistant - {self.sensorname}"
+                            f"Message '{message}' ignored (repeat within {self.repeat_horizon}s)"
                         )
-                        headers = {
-                            "Authorization": "Bearer " + self.token,
-                            "content-type": "application/json",
-                        }
-
-                        response = requests.post(
-                            self.baseurl + "/api/states/sensor." + self.sensorname,
-                            headers=headers,
-                            data=json.dumps(
-                                data,
-                                default=lambda o: o.__dict__,
-                                sort_keys=True,
-                                indent=4,
-                            ),
+                        self.metrics.inc(
+                            "p2000_messages_total", result="repeat_suppressed"
                         )
-                        response.raise_for_status()
-                        self.logger.debug(f"POST data: {data}")
+                        return
+
+                # After midnight (UTC), reset the opencage disable
+                hour = datetime.utcnow()
+                if (
+                    self.geocoder
+                    and hour.hour >= 0
+                    and hour.minute >= 1
+                    and hour.hour < 1
+                    and hour.minute < 15
+                ):
+                    self.geocoder.disabled = False
+
+                msg = MessageItem()
+                msg.timereceived = timereceived
+                msg.groupid = groupid
+                msg.receivers = receiver
+                msg.capcodes = capcodes.split(" ")
+                msg.body = message
+                msg.message_raw = line
+                msg.disciplines = discipline
+                msg.priority = priority
+                msg.region = region
+                msg.location = location
+                msg.postalcode = postalcode
+                msg.longitude = longitude
+                msg.latitude = latitude
+                msg.city = city
+                msg.street = street
+                msg.address = address
+                msg.remarks = remark
+                msg.mapurl = mapurl
+                msg.timestamp = timestamp
+                msg.is_posted = False
+                msg.sources = sources
+
+                repeated = repeat is not None and not repeat.geocode_pending
+                if repeated:
+                    self.logger.debug(f"Message '{message}' is a repeat, posting update")
+                    msg.latitude = repeat.latitude
+                    msg.longitude = repeat.longitude
+                    msg.mapurl = repeat.mapurl
+                    msg.city = repeat.city
+                    gpscheck = repeat.gps_checked
+                    # Sensors only match differently if any of their criteria differ,
+                    # keywords are matched case sensitive on the body
+                    if (
+                        msg.body == repeat.body
+                        and set(msg.capcodes) == set(repeat.capcodes)
+                        and msg.region == repeat.region
+                        and msg.disciplines == repeat.disciplines
+                    ):
+                        msg.routes = repeat.routes
+
+                # If address is filled and OpenCage is enabled check for GPS coordinates
+                # First check local geocode cache, else look it up in the background
+                elif address and self.use_opencage:
+                    self.logger.debug(f"Checking geocode cache - {address}")
+                    cached = self.geocache.get(address)
+                    started = self.stage_done("geocode_cache", started)
+                    if cached is not None:
+                        found, msg.latitude, msg.longitude, msg.mapurl = cached
                         self.logger.debug(
-                            f"POST status: {response.status_code} {response.reason}"
-                        )
-                        self.logger.debug(f"POST text: {response.text}")
-                        self.logger.debug(f"OpenCage status: {msg.opencage}")
-                    except requests.HTTPError:
-                        self.logger.error(
-                            f"HTTP Error while trying to post data, check baseurl and token in config.ini: {response.status_code} {response.reason}"
-                        )
-                    except requests.exceptions.SSLError as err:
-                        self.logger.error(
-                            f"SSL Error occurred while trying to post data, check baseurl in config.ini:\n{err}"
-                        )
-                    except requests.exceptions.ConnectionError as err:
-                        self.logger.error(
-                            f"Connection Error occurred while trying to post data, check baseurl in config.ini:\n{err}"
+                            f"Geocode cache results: {found}, {msg.latitude}, {msg.longitude}, {msg.mapurl}"
                         )
-                    finally:
-                        # Mark as posted to prevent race conditions
-                        msg.is_posted = True
-
-                if self.use_mqtt:
-                    try:
-                        self.logger.debug("Posting to MQTT")
-                        self.mqtt_topic_sensor = (
-                            self.mqtt_topic + "/sensor/" + self.sensorname
-                        )
-
-                        data = json.dumps(data)
-                        client = mqtt.Client()
-                        client.username_pw_set(self.mqtt_username, self.mqtt_password)
-                        client.connect(self.mqtt_server, self.mqtt_port, 60)
-                        client.publish(self.mqtt_topic_sensor, data)
-                        client.disconnect()
-
+                        gpscheck = True
+                    elif self.geocoder.disabled is False:
                         self.logger.debug(
-                            f"MQTT status: Posting to {self.mqtt_server}:{self.mqtt_port} topic:{self.mqtt_topic}"
+                            f"Address {address} not found in geocode cache"
                         )
-                        self.logger.debug(f"MQTT json: {data}")
-                    except Exception as e:
-                        self.logger.debug(f"MQTT Crashed: {e}")
-                    finally:
-                        # Mark as posted to prevent race conditions
-                        msg.is_posted = True
+                        msg.geocode_pending = True
+                        msg.geocode_deadline = (
+                            msg.timereceived + self.geocode_budget
+                        )
+                        if not self.geocoder.lookup(
+                            address, functools.partial(self.on_geocoded, msg)
+                        ):
+                            msg.geocode_pending = False
+
+                msg.gps_checked = gpscheck
+                msg.opencage = f"enabled: {self.use_opencage} ratelimit: {self.geocoder.disabled if self.geocoder else False} gps-checked: {gpscheck}"
+                self.messages.add(msg)
+                msg.release_deadline = msg.timereceived + self.post_delay
+                self.scheduler.schedule(msg, msg.release_deadline)
+                self.metrics.inc(
+                    "p2000_messages_total", result="repeat" if repeated else "new"
+                )
+                if self.repeats is not None:
+                    self.repeats.set(message_fingerprint(message), msg)
+
+    def watch(self, filename, attribute, load):
+        """Reload attribute with load() when filename changes."""
+        self.watcher.watch(
+            os.path.join(datadir, filename),
+            functools.partial(self.reload, filename, attribute, load),
+        )
 
-    def data_thread_call(self):
-        """Thread for parsing data from RTL-SDR."""
-        self.logger.info(f"RTL-SDR process started with: {self.rtlfm_cmd}")
-        multimon_ng = subprocess.Popen(
-            self.rtlfm_cmd, stdout=subprocess.PIPE, shell=True
+    def load_router(self):
+        """Read sensor sections from the config file, return new SensorRouter."""
+        config = configparser.ConfigParser()
+        if not config.read(os.path.join(datadir, self.options.config)):
+            raise OSError(f"could not read {self.options.config}")
+        self.logger.info("Reloading sensors, other config changes need a restart")
+        return SensorRouter(
+            load_sensors(self, config),
+            exact_distance=self.exact_distance,
+            distance_prefilter=self.distance_prefilter,
         )
-        try:
-            while self.running:
-                # Read line from process
-                line = multimon_ng.stdout.readline()
-                try:
-                    line = line.decode("utf8", "backslashreplace")
-                except UnicodeDecodeError:
-                    self.logger.debug(f"Error while decoding utf8 string: {line}")
-                    line = ""
-                multimon_ng.poll()
-                if line.startswith("FLEX") and line.__contains__("ALN"):
-                    line_data = line.split("|")
-                    timestamp = line_data[1]
-                    groupid = line_data[3].strip()
-                    capcodes = line_data[4].strip()
-                    message = line_data[6].strip()
-                    priority = p2000_get_prio(message)
-                    location = ""
-                    postalcode = ""
-                    city = ""
-                    address = ""
-                    street = ""
-                    longitude = ""
-                    latitude = ""
-                    opencage = ""
-                    distance = ""
-                    mapurl = ""
-                    gpscheck = False
-
-                    self.logger.debug(line.strip())
-
-                    # Check capcodes first, only if they are defined in config
-                    if self.matchcapcodes or self.ignorecapcodes:
-                        for capcode in capcodes.split(" "):
-                            if self.matchcapcodes:
-                                # Apply filter
-                                if capcode in self.matchcapcodes:
-                                    self.logger.debug(
-                                        f"Capcode '{capcode}' found in '{self.matchcapcodes}' (capcode in match_capcodes)"
-                                    )
-                                else:
-                                    self.logger.debug(
-                                        f"Message '{message}' ignored because capcode '{capcode}' not found in '{self.matchcapcodes}'"
-                                    )
-                                    continue
-
-                            if self.ignorecapcodes and len(capcodes.split(" ")) == 1:
-                                if capcode in self.ignorecapcodes:
-                                    self.logger.debug(
-                                        f"Message '{message}' ignored because it contains only one capcode '{capcode}' which is found in '{self.ignorecapcodes}' (capcode in ignore_capcodes)"
-                                    )
-                                    continue
-
-                    # Check for ignore texts
-                    if check_filter(self.ignoretext, message):
-                        self.logger.debug(
-                            f"Message '{message}' ignored (matched ignore_text)"
-                        )
-                        if self.logtofile:
-                            logmessage = "Ignore text" + " -|- " + line.strip()
-                            log2file(logmessage)
-                        continue
 
-                    # Get address info if any, look for valid postalcode and get the two words around them
-                    # A2 (DIA: ja) AMBU 17106 Schiedamseweg 3134BA Vlaardingen VLAARD bon 8576
-                    regex_address = r"(\w*.) ([1-9][0-9]{3}[a-zA-Z]{2}) (.\w*)"
-                    addr = re.search(regex_address, message)
-                    if addr:
-                        street = addr.group(1)
-                        postalcode = addr.group(2)
-                        city = addr.group(3)
-                        address = f"{street} {postalcode} {city}"
-
-                        # Remove Capitalized city name from message (when postalcode is found)
-                        regex_afkortingen = "[A-Z]{2,}"
-                        afkortingen = re.findall(regex_afkortingen, message)
-                        for afkorting in afkortingen:
-                            if afkorting in self.pltsnmn:
-                                message = re.sub(afkorting, "", message)
-
-                    # Get address in info if any, look for valid postalcode without letters and get the two words around them
-                    # A1 13108 Surinameplein 1058 Amsterdam 12006
-                    regex_address2 = r"(\w*.) ([1-9][0-9]{3}) (.\w*)"
-                    addr2 = re.search(regex_address2, message)
-                    if addr2:
-                        # print("Regex Amsterdam")
-                        street = addr2.group(1)
-                        postalcode = addr2.group(2)
-                        city = addr2.group(3)
-                        address = f"{street} {city}"
-
-                        # Remove Capitalized city name from message (when postalcode is found)
-                        regex_afkortingen = "[A-Z]{2,}"
-                        afkortingen = re.findall(regex_afkortingen, message)
-                        for afkorting in afkortingen:
-                            if afkorting in self.pltsnmn:
-                                message = re.sub(afkorting, "", message)
-
-                    # Try to get city only when there is one after a prio
-                    # A1 Breda
-                    else:
-                        regex_prio_loc = r"(^A\s?1|\s?A\s?2|B\s?1|^B\s?2|^B\s?3|PRIO\s?1|^P\s?1|PRIO\s?2|^P\s?2) (.\w*)"
-                        loc = re.search(regex_prio_loc, message)
-                        if loc and loc.group(2) in self.plaatsnamen:
-                            city = loc.group(2)
-                        else:
-                            # Find all uppercase words and check if there is a valid city name amoung them
-                            # A2 Ambulancepost Moordrecht Middelweg MOORDR V
-                            regex_afkortingen = "[A-Z]{2,}"
-                            afkortingen = re.findall(regex_afkortingen, message)
-                            for afkorting in afkortingen:
-                                if afkorting in self.pltsnmn:
-                                    city = self.pltsnmn[afkorting]["plaatsnaam"]
-                                    # If uppercase city is found, grab first word before that city name, since it's likely to be the streetname
-                                    regex_address = rf"(\w*.) ({afkorting})"
-                                    addr = re.search(regex_address, message)
-                                    if addr:
-                                        street = addr.group(1)
-                                    address = f"{street} {city}"
-                                    # Change uppercase city to normal city in message
-                                    message = re.sub(afkorting, city, message)
-
-                        # If no address is found, do a wild guess
-                        if not address:
-                            # Strip all status info from messag
-                            regex_messagestrip = r"(^A\s?1|\s?A\s?2|B\s?1|^B\s?2|^B\s?3|PRIO\s?1|^P\s?1|PRIO\s?2|^P\s?2|^PRIO\s?3|^P\s?3|^PRIO\s?4|^P\s?4)(\W\d{2,}|.*(BR)\b|)|(rit:|rit|bon|bon:|ambu|dia|DIA)\W\d{5,8}|\b\d{5,}$|( : )|\(([^\)]+)\)( \b\d{5,}|)|directe (\w*)|(-)+/gi"
-                            strip = re.sub(regex_messagestrip, "", message, flags=re.I)
-                            # Strip any double spaces from message
-                            regex_doublespaces = r"(^[ \t]+|[ \t]+$)"
-                            strip = re.sub(regex_doublespaces, "", strip)
-                            # Strip all double words from message
-                            regex_doublewords = r"(\b\S+\b)(?=.*\1)"
-                            strip = re.sub(regex_doublewords, "", strip)
-                            # print("Strip: " + strip)
-                            # Search in leftover message for a city corresponding to City list
-                            for plaatsnaam in self.plaatsnamen:
-                                if plaatsnaam in strip:
-                                    self.logger.debug("City found: " + plaatsnaam)
-                                    # Find first word left from city
-                                    regex_plaatsnamen_strip = (
-                                        rf"\w*.[a-z|A-Z] \b{plaatsnaam}\b"
-                                    )
-                                    plaatsnamen_strip = re.search(
-                                        regex_plaatsnamen_strip, strip
-                                    )
-                                    if plaatsnamen_strip:
-                                        addr = plaatsnamen_strip.group(0)
-                                        # Final non address symbols strip
-                                        regex_plaatsnamen_strip_strip = (
-                                            r"(- )|(\w[0-9] )"
-                                        )
-                                        addr = re.sub(
-                                            regex_plaatsnamen_strip_strip, "", addr
-                                        )
-                                        address = addr
-                                        city = plaatsnaam
-                                        self.logger.debug(
-                                            "Adress found: "
-                                            + plaatsnamen_strip.group(0)
-                                        )
-
-                    # Get more info about the capcodes
-                    for capcode in capcodes.split(" "):
-                        if capcode in self.capcodes:
-                            receiver = "{} ({})".format(
-                                self.capcodes[capcode]["description"], capcode
-                            )
-                            discipline = "{}".format(
-                                self.capcodes[capcode]["discipline"]
-                            )
-                            region = self.capcodes[capcode]["region"]
-                            location = self.capcodes[capcode]["location"]
-                            remark = self.capcodes[capcode]["remark"]
-                        else:
-                            receiver = capcode
-                            discipline = ""
-                            region = ""
-                            remark = ""
-
-                    # If this message was already received, only add extra info
-                    if len(self.messages) > 0 and self.messages[0].body == message:
-                        if self.messages[0].receivers == "":
-                            self.messages[0].receivers = receiver
-                        elif receiver:
-                            self.messages[0].receivers += ", " + receiver
-
-                        if self.messages[0].disciplines == "":
-                            self.messages[0].disciplines = discipline
-                        elif discipline:
-                            self.messages[0].disciplines += ", " + discipline
-                        if self.messages[0].remarks == "":
-                            self.messages[0].remarks = remark
-                        elif remark:
-                            self.messages[0].remarks += ", " + remark
-
-                        if self.messages[0].region == "":
-                            self.messages[0].region = region
-
-                        self.messages[0].capcodes.append(capcode)
-                        self.messages[0].location = location
-                        self.messages[0].postalcode = postalcode
-                        self.messages[0].city = city
-                        self.messages[0].street = street
-                        self.messages[0].address = address
-                    else:
-                        # After midnight (UTC), reset the opencage disable
-                        hour = datetime.utcnow()
-                        if (
-                            hour.hour >= 0
-                            and hour.minute >= 1
-                            and hour.hour < 1
-                            and hour.minute < 15
-                        ):
-                            self.opencage_disabled = False
-
-                        # If address is filled and OpenCage is enabled check for GPS coordinates
-                        # First check local GPS database file
-                        if address and self.use_opencage and not gpscheck is True:
-                            try:
-                                self.logger.debug(f"Checking databasefile - {address}")
-                                if address in self.gpsdatabase:
-                                    self.logger.debug(
-                                        f"Address is found in databasefile - {address}"
-                                    )
-                                    mapurl = self.gpsdatabase[address]["url"]
-                                    latitude = self.gpsdatabase[address]["latitude"]
-                                    longitude = self.gpsdatabase[address]["lontitude"]
-                                    self.logger.debug(
-                                        f"GPS Database results: {latitude}, {longitude}, {mapurl}"
-                                    )
-                                    gpscheck = True
-                                else:
-                                    self.logger.debug(
-                                        f"Address {address} not found in databasefile"
-                                    )
-                            except:
-                                self.logger.info(
-                                    f"Error checking {address} in databasefile"
-                                )
-
-                        # If not found in GPS database file, check opencage
-                        # If address is filled and OpenCage is enabled check for GPS coordinates
-                        if (
-                            address
-                            and self.use_opencage
-                            and (self.opencage_disabled is False)
-                            and not gpscheck is True
-                        ):
-                            geocoder = OpenCageGeocode(self.opencagetoken)
-                            try:
-                                gps = geocoder.geocode(address, countrycode="nl")
-                                gpscheck = True
-                                if gps:
-                                    latitude = gps[0]["geometry"]["lat"]
-                                    longitude = gps[0]["geometry"]["lng"]
-                                    mapurl = gps[0]["annotations"]["OSM"]["url"]
-                                    self.logger.debug(
-                                        f"OpenCage results: {latitude}, {longitude}, {mapurl}"
-                                    )
-                                    # Write opencage GPS data to local GPS database file
-                                    try:
-                                        gps_data_fieldnames = [
-                                            "address",
-                                            "latitude",
-                                            "lontitude",
-                                            "url",
-                                        ]
-                                        gps_data = {
-                                            "address": address,
-                                            "latitude": latitude,
-                                            "lontitude": longitude,
-                                            "url": mapurl,
-                                        }
-                                        self.logger.debug(
-                                            f"Writing to databasefile - {address}"
-                                        )
-                                        with open(
-                                            "location_gps_database.csv", "a"
-                                        ) as outfile:
-                                            writer = csv.DictWriter(
-                                                outfile,
-                                                fieldnames=gps_data_fieldnames,
-                                                delimiter=",",
-                                                quoting=csv.QUOTE_MINIMAL,
-                                                lineterminator="\n",
-                                            )
-                                            writer.writerow(gps_data)
-
-                                        # Write also to GPS data in memory
-                                        self.gpsdatabase[address] = {
-                                            "latitude":latitude,
-                                            "lontitude":longitude,
-                                            "url":mapurl,
-                                        }
-                                        self.logger.debug(
-                                            f"Writing variable - {address}"
-                                        )
-                                    except:
-                                        self.logger.debug(
-                                            f"saving to local gpsfile or variable error - {address}"
-                                        )
-
-                                else:
-                                    latitude = ""
-                                    longitude = ""
-                                    mapurl = ""
-                            # Rate-error check from opencage
-                            except RateLimitExceededError as rle:
-                                self.logger.error(rle)
-                                # Over rate, opencage check disabled
-                                if rle:
-                                    self.opencage_disabled = True
-                            except InvalidInputError as ex:
-                                self.logger.error(ex)
-                        else:
-                            gpscheck = False
-
-                        opencage = f"enabled: {self.use_opencage} ratelimit: {self.opencage_disabled} gps-checked: {gpscheck}"
-
-                        msg = MessageItem()
-                        msg.groupid = groupid
-                        msg.receivers = receiver
-                        msg.capcodes = capcodes.split(" ")
-                        msg.body = message
-                        msg.message_raw = line.strip()
-                        msg.disciplines = discipline
-                        msg.priority = priority
-                        msg.region = region
-                        msg.location = location
-                        msg.postalcode = postalcode
-                        msg.longitude = longitude
-                        msg.latitude = latitude
-                        msg.city = city
-                        msg.street = street
-                        msg.address = address
-                        msg.remarks = remark
-                        msg.opencage = opencage
-                        msg.mapurl = mapurl
-                        msg.timestamp = to_local_datetime(timestamp)
-                        msg.is_posted = False
-                        msg.distance = distance
-                        self.messages.insert(0, msg)
-
-                # Limit the message list size
-                if len(self.messages) > 100:
-                    self.messages = self.messages[:100]
-
-        except KeyboardInterrupt:
-            os.kill(multimon_ng.pid, 9)
+    def reload(self, filename, attribute, load):
+        """Load changed file in the background and swap in the result."""
+        started = time.perf_counter()
+        try:
+            # Loaders return empty data for missing files, check it is there first
+            if os.path.getsize(os.path.join(datadir, filename)) == 0:
+                raise ValueError("file is empty")
+            value = load()
+            if len(value) == 0 and len(getattr(self, attribute)):
+                raise ValueError("no records loaded")
+        except Exception as err:
+            self.logger.error(f"Reloading '{filename}' failed, keeping old data: {err}")
+            self.metrics.inc("p2000_reloads_total", file=filename, result="error")
+            return
+        # Replacing the attribute is atomic, a line in progress uses the old data
+        setattr(self, attribute, value)
+        duration = time.perf_counter() - started
+        self.logger.info(
+            f"Reloaded '{filename}' in {duration * 1000:.1f} ms, {len(value)} records"
+        )
+        self.metrics.inc("p2000_reloads_total", file=filename, result="ok")
+        self.metrics.observe("p2000_reload_seconds", duration, file=filename)
+        self.metrics.set("p2000_reload_records", len(value), file=filename)
 
-        self.logger.debug("Data thread stopped")
+    def stage_done(self, stage, started):
+        """Record duration of pipeline stage, return start time of the next one."""
+        now = time.perf_counter()
+        self.metrics.observe("p2000_stage_seconds", now - started, stage=stage)
+        return now
 
     # Thread for posting data to Home Assistant
     def post_thread_call(self):
         """Thread for posting data."""
         self.logger.debug("Post thread started")
-        while True:
-            if self.running is False:
+        while self.running:
+            msg = self.scheduler.get()
+            if msg is None:
                 break
-
-            now = time.monotonic()
-            for msg in self.messages:
-                if msg.is_posted is False and now - msg.timereceived >= 1.0:
-                    self.post_data(msg)
-            time.sleep(1.0)
+            # Wait for coordinates until the geocode time budget runs out
+            if msg.geocode_pending and time.monotonic() < msg.geocode_deadline:
+                self.scheduler.schedule(msg, msg.geocode_deadline)
+                continue
+            self.apply_geocoded(msg)
+            self.post_data(msg)
         self.logger.debug("Post thread stopped")
 
 
-# Start application
-Main()
+if __name__ == "__main__":
+    # Change to program directory
+    os.chdir(datadir)
+
+    # Parse command line
+    args = parse_args()
+
+    # Load configuration
+    config = load_config(args.config)
+
+    # Init logging
+    logger = Logger(datadir, 7, config.getboolean("main", "debug"))
+
+    # Start application
+    Main(args)
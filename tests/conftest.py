@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import p2000  # noqa: E402
+
+
+class Context:
+    """Minimal stand-in for Main, needed by the p2000 load functions."""
+
+    def __init__(self):
+        self.logger = logging.getLogger("test")
+
+
+@pytest.fixture
+def context():
+    """Return a stand-in for Main."""
+    return Context()
+
+
+@pytest.fixture
+def datadir(tmp_path, monkeypatch):
+    """Load data files from a temporary directory."""
+    monkeypatch.setattr(p2000, "datadir", str(tmp_path))
+    return tmp_path
+
+
+CONFIG = """[main]
+debug = False
+logtofile = False
+post_delay = 0
+
+[rtl-sdr]
+cmd = false
+
+[home-assistant]
+enabled = True
+baseurl = http://127.0.0.1:9
+token = x
+
+[mqtt]
+enabled = False
+mqtt_server = 127.0.0.1
+mqtt_port = 1883
+mqtt_user = u
+mqtt_password = p
+mqtt_topic = p2000
+
+[opencage]
+enabled = False
+token = x
+
+[sensor_p2000]
+friendlyname = all
+searchkeyword = *
+"""
+
+
+@pytest.fixture
+def replay(tmp_path):
+    """Return function replaying lines through a copy of p2000.py in dry-run mode.
+
+    Files maps extra data file names to their contents, speed is the replay
+    speed. The recorded posts are returned as a list of dicts.
+    """
+
+    def run(lines, files=None, speed=0):
+        for filename in ("p2000.py", "db_plaatsnamen.txt", "db_pltsnmn.txt"):
+            shutil.copy(os.path.join(ROOT, filename), tmp_path)
+        (tmp_path / "config.ini").write_text(CONFIG)
+        for filename, content in (files or {}).items():
+            (tmp_path / filename).write_text(content)
+        (tmp_path / "replay.txt").write_text("".join(line + "\n" for line in lines))
+        subprocess.run(
+            [
+                sys.executable,
+                str(tmp_path / "p2000.py"),
+                "--replay",
+                "replay.txt",
+                "--speed",
+                str(speed),
+                "--dry-run",
+                "posts.jsonl",
+            ],
+            cwd=tmp_path,
+            timeout=60,
+            check=True,
+            capture_output=True,
+        )
+        posts = tmp_path / "posts.jsonl"
+        if not posts.exists():
+            return []
+        return [json.loads(row) for row in posts.read_text().splitlines()]
+
+    return run
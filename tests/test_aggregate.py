@@ -0,0 +1,46 @@
+from conftest import CONFIG
+
+SENSORS = """
+[sensor_groningen]
+searchcapcode = 000120901
+"""
+
+
+def config(post_delay, aggregate_window=10):
+    return (
+        CONFIG.replace("post_delay = 0", f"post_delay = {post_delay}")
+        .replace("[rtl-sdr]", f"aggregate_window = {aggregate_window}\n\n[rtl-sdr]")
+        + SENSORS
+    )
+
+
+def flex(timestamp, capcode, message="A1 Kerkstraat 3811AB Amersfoort"):
+    return f"FLEX|2021-06-28 08:00:{timestamp:02d}|1600/2/K/A|11.036|{capcode}|ALN|{message}"
+
+
+def targets(posts):
+    return [post["target"].rsplit(".", 1)[-1] for post in posts]
+
+
+def test_copies_in_window_are_posted_once(replay):
+    # Every copy arrives within post_delay of the previous one
+    posts = replay(
+        [flex(0, "001523951"), flex(1, "001523952"), flex(2, "001523953")],
+        {"config.ini": config(post_delay=1.5)},
+        speed=1,
+    )
+    assert targets(posts) == ["p2000"]
+    assert posts[0]["data"]["attributes"]["capcodes"] == [
+        "001523951",
+        "001523952",
+        "001523953",
+    ]
+
+
+def test_copy_after_release_only_posts_to_new_sensors(replay):
+    posts = replay(
+        [flex(0, "001523951"), flex(3, "000120901")],
+        {"config.ini": config(post_delay=1)},
+        speed=1,
+    )
+    assert targets(posts) == ["p2000", "groningen"]
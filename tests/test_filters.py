@@ -0,0 +1,29 @@
+import p2000
+
+
+def test_capcode_filter_with_only_comments_and_blank_lines(context, datadir):
+    (datadir / "match_capcodes.txt").write_text(
+        "# Capcodes to match\n\n#000120901,Brandweer Groningen\n   \n"
+    )
+    matchcapcodes = p2000.load_capcodes_filter(context, "match_capcodes.txt")
+    assert len(matchcapcodes) == 0
+
+
+def test_capcode_filter_skips_blank_lines(context, datadir):
+    (datadir / "match_capcodes.txt").write_text(
+        "000120901,Brandweer Groningen\n\n000120111\n"
+    )
+    matchcapcodes = p2000.load_capcodes_filter(context, "match_capcodes.txt")
+    assert len(matchcapcodes) == 2
+    assert matchcapcodes.match_any(["000120111", "001523951"])
+    assert not matchcapcodes.match_any(["001523951"])
+
+
+def test_messages_pass_match_capcodes_with_only_comments(replay):
+    posts = replay(
+        [
+            "FLEX|2021-06-28 08:07:13|1600/2/K/A|11.036|001523951|ALN|A1 13108 Surinameplein 1058 Amsterdam 12006",
+        ],
+        {"match_capcodes.txt": "# Capcodes to match\n#000120901\n\n"},
+    )
+    assert len(posts) == 1
@@ -0,0 +1,59 @@
+import logging
+import time
+import types
+
+import p2000
+
+
+class Scheduler:
+    """Records scheduled messages instead of posting them."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, msg, when):
+        self.scheduled.append(msg)
+
+
+def geocode_context():
+    return types.SimpleNamespace(
+        logger=logging.getLogger("test"),
+        scheduler=Scheduler(),
+        geocoder=types.SimpleNamespace(disabled=False),
+        post_delay=0,
+    )
+
+
+def posted_message():
+    msg = p2000.MessageItem()
+    msg.body = "A1 Kerkstraat Amersfoort"
+    msg.timereceived = time.monotonic()
+    msg.is_posted = True
+    msg.geocode_pending = True
+    return msg
+
+
+def test_posted_message_not_reposted_when_not_found():
+    context = geocode_context()
+    msg = posted_message()
+    p2000.Main.on_geocoded(context, msg, (False, "", "", ""))
+    assert context.scheduler.scheduled == []
+    assert msg.geocoded is None
+    assert not msg.geocode_pending
+
+
+def test_posted_message_not_reposted_without_result():
+    context = geocode_context()
+    msg = posted_message()
+    p2000.Main.on_geocoded(context, msg, None)
+    assert context.scheduler.scheduled == []
+    assert not msg.geocode_pending
+
+
+def test_posted_message_reposted_with_coordinates():
+    context = geocode_context()
+    msg = posted_message()
+    result = (True, "52.15", "5.38", "https://www.openstreetmap.org")
+    p2000.Main.on_geocoded(context, msg, result)
+    assert context.scheduler.scheduled == [msg]
+    assert msg.geocoded == (result, False)
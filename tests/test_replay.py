@@ -0,0 +1,10 @@
+def test_corrupt_timestamp_is_skipped(replay):
+    posts = replay(
+        [
+            "FLEX|2021-13-45 99:00:00|1600/2/K/A|11.036|001523951|ALN|A1 Kerkstraat 3811AB Amersfoort",
+            "FLEX|garbage|1600/2/K/A|11.036|001523951|ALN|A1 Dorpsstraat Zwolle",
+            "FLEX|2021-06-28 08:07:13|1600/2/K/A|11.036|001523951|ALN|A1 13108 Surinameplein 1058 Amsterdam 12006",
+        ]
+    )
+    assert len(posts) == 1
+    assert posts[0]["data"]["attributes"]["city"] == "Amsterdam"
@@ -1,6 +1,8 @@
 #!/bin/bash
 echo "Updating capcodes"
 ./convert/tools/gen_db_capcodes.py
+echo "Compiling capcodes"
+./convert/tools/gen_db_capcodes_bin.py
 echo "Updating plaatsnamen"
 ./convert/tools/gen_db_plaatsnamen.py
 echo "Updating plaatsnaamafkortingen"